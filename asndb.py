@@ -0,0 +1,206 @@
+# encoding: utf-8 (as per PEP 263)
+
+# Offline IP-to-ASN data for quicksearch's /ipi endpoints, so that most
+# lookups don't need the Team Cymru DNS service at all.
+#
+# Supported input files (in data/):
+#
+# - prefix-to-ASN tables in CAIDA's RouteViews pfx2as format, for IPv4
+#   and/or IPv6 (https://www.caida.org/catalog/datasets/routeviews-prefix2as/):
+#
+#       1.0.0.0	24	13335
+#       2001:db8::	32	64496_64497
+#
+#   (multi-origin prefixes separate their ASNs with '_', AS sets with ',')
+#
+# - an AS name list with one "<ASN> <name>" per line, e.g. RIPE's
+#   https://ftp.ripe.net/ripe/asnames/asn.txt:
+#
+#       13335 CLOUDFLARENET, US
+#
+# All prefixes are flattened into sorted, non-overlapping address ranges
+# (most specific prefix wins) that are searched with bisect.  Everything is
+# reloaded in a background thread when any of the files' modification times
+# change; until the first load is done, no lookup is answered locally.
+
+import array
+import bisect
+import os
+import socket
+
+import eventlog
+import reloader
+
+# IP version -> (address family, address length in bits)
+FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+
+
+def parse_prefix(address, length):
+    # returns: (IP version, first address, last address, "address/length")
+    #          with the addresses as integers; raises ValueError (like
+    #          ipaddress.ip_network) for anything that isn't a valid prefix
+    version = 6 if ':' in address else 4
+    family, bits = FAMILIES[version]
+    try:
+        packed = socket.inet_pton(family, address)
+    except OSError:
+        raise ValueError('invalid address %r' % address)
+    length = int(length)
+    if not 0 <= length <= bits:
+        raise ValueError('invalid prefix length %d' % length)
+
+    start = int.from_bytes(packed, 'big')
+    host_mask = (1 << (bits - length)) - 1
+    if start & host_mask:
+        raise ValueError('%s/%d has host bits set' % (address, length))
+    return (version, start, start | host_mask, '%s/%d' % (socket.inet_ntop(family, packed), length))
+
+
+def parse_pfx2as(path):
+    # yields: (IP version, first address, last address, "address/length",
+    #          tuple of origin ASNs)
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 3:
+                continue
+            try:
+                version, start, end, prefix = parse_prefix(parts[0], parts[1])
+                asns = tuple(int(asn) for asn in parts[2].replace(',', '_').split('_'))
+            except ValueError:
+                continue
+            yield (version, start, end, prefix, asns)
+
+
+def parse_asn_names(path):
+    # returns: dict mapping ASN to name
+    names = dict()
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) != 2:
+                continue
+            try:
+                names[int(parts[0])] = parts[1]
+            except ValueError:
+                continue
+    return names
+
+
+class RangeTable:
+    # Longest-prefix-match table for one IP version: starts[i] is the first
+    # address of range i, which extends up to starts[i+1] - 1 and belongs to
+    # values[entries[i]] (None for address space that isn't covered).
+
+    def __init__(self, prefixes, max_address):
+        # prefixes: list of (first address, last address, value)
+        # IPv4 fits into a compact unsigned 32-bit array, IPv6 doesn't
+        self.starts = array.array('I') if max_address < 2**32 else []
+        self.entries = array.array('I')
+        self.values = [None]
+        value_indices = {None: 0}
+
+        def emit(start, value):
+            if start > max_address:
+                return
+            index = value_indices.get(value)
+            if index is None:
+                index = value_indices[value] = len(self.values)
+                self.values.append(value)
+            if self.starts and self.starts[-1] == start:
+                # a more specific prefix starting at the same address
+                self.entries[-1] = index
+            elif not self.entries or self.entries[-1] != index:
+                self.starts.append(start)
+                self.entries.append(index)
+
+        # less specific prefixes first, so nested ones overwrite them
+        ranges = sorted(prefixes, key=lambda r: (r[0], -r[1]))
+
+        # enclosing prefixes that are still "open": (last address, value)
+        stack = []
+        for start, end, value in ranges:
+            while stack and stack[-1][0] < start:
+                closed_end, closed_value = stack.pop()
+                emit(closed_end + 1, stack[-1][1] if stack else None)
+            emit(start, value)
+            stack.append((end, value))
+        while stack:
+            closed_end, closed_value = stack.pop()
+            emit(closed_end + 1, stack[-1][1] if stack else None)
+
+    def lookup(self, address):
+        index = bisect.bisect_right(self.starts, address) - 1
+        if index < 0:
+            return None
+        return self.values[self.entries[index]]
+
+
+class ASNDatabase:
+    def __init__(self, prefix_paths, names_path=None):
+        self.prefix_paths = prefix_paths
+        self.names_path = names_path
+        # (IPv4 table, IPv6 table, AS names), rebuilt whenever the files change
+        self._reloader = reloader.Reloader(self._signature, self._load, background=True, name='asndb')
+
+    def _signature(self):
+        signature = []
+        for path in list(self.prefix_paths) + [self.names_path]:
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except (OSError, TypeError):
+                signature.append(None)
+        return tuple(signature)
+
+    def _load(self, previous):
+        try:
+            return self._parse()
+        except Exception as e:
+            eventlog.log('asndb_error', error=str(e) or repr(e))
+            # don't retry until the files change again
+            return previous
+
+    def _parse(self):
+        prefixes = {4: [], 6: []}
+        for path in self.prefix_paths:
+            if not os.path.isfile(path):
+                continue
+            for version, start, end, prefix, asns in parse_pfx2as(path):
+                prefixes[version].append((start, end, (prefix, asns)))
+
+        names = dict()
+        if self.names_path and os.path.isfile(self.names_path):
+            names = parse_asn_names(self.names_path)
+
+        return (
+                RangeTable(prefixes[4], 2**32 - 1),
+                RangeTable(prefixes[6], 2**128 - 1),
+                names,
+                )
+
+    def reload(self):
+        # returns: the current (IPv4 table, IPv6 table, AS names), or None
+        #          until they have been loaded for the first time
+        #
+        # Loading a full RouteViews table takes a while, so it's done in a
+        # background thread (started by whichever request notices a change
+        # first) while everybody keeps using the previous tables.
+        return self._reloader.get()
+
+    def origin(self, addr):
+        # returns: (prefix as string, tuple of origin ASNs) of the most
+        #          specific prefix covering addr, or None
+        tables = self.reload()
+        if tables is None:
+            return None
+        ipv4, ipv6, names = tables
+        table = ipv4 if addr.version == 4 else ipv6
+        return table.lookup(int(addr))
+
+    def name(self, asn):
+        # returns: the AS name, or None if unknown
+        tables = self.reload()
+        if tables is None:
+            return None
+        ipv4, ipv6, names = tables
+        return names.get(asn)
@@ -0,0 +1,494 @@
+# encoding: utf-8 (as per PEP 263)
+
+# Client for the (undocumented) RPC API behind https://bahn.expert, used by
+# quicksearch's /zug/ endpoints to find train journeys by train number.
+#
+# BahnExpertClient uses requests and worker threads; AsyncBahnExpertClient
+# is the same on top of httpx for asyncio (see quicksearch_asgi.py).
+
+import asyncio
+import concurrent.futures
+import json
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import eventlog
+import metrics
+
+RPC_URL = 'https://bahn.expert/rpc/%s'
+# bahn.expert has renamed this endpoint before; try them in this order
+RPC_ENDPOINTS = ['journeys.find', 'journey.find']
+
+# upper limit for the number of days searched by a single request
+MAX_SEARCHDATES = 7
+# ... and for how far (in days) a relative date may be from today
+MAX_DAY_OFFSET = 3660
+
+UIC_COUNTRY_CODES = {
+        'FI': 10,
+        'RU': 20,
+        'BY': 21,
+        'UA': 22,
+        'MD': 23,
+        'LT': 24,
+        'LV': 25,
+        'EE': 26,
+        'KZ': 27,
+        'GE': 28,
+        'UZ': 29,
+        'KP': 30,
+        'MN': 31,
+        'VN': 32,
+        'CN': 33,
+        'LA': 34,
+        'CU': 40,
+        'AL': 41,
+        'JP': 42,
+        'BA': 44,
+        'BA': 49,
+        'BA': 50,
+        'PL': 51,
+        'BG': 52,
+        'RO': 53,
+        'CZ': 54,
+        'HU': 55,
+        'SK': 56,
+        'AZ': 57,
+        'AM': 58,
+        'KG': 59,
+        'IE': 60,
+        'KR': 61,
+        'ME': 62,
+        'MK': 65,
+        'TJ': 66,
+        'TM': 67,
+        'AF': 68,
+        'GB': 70,
+        'ES': 71,
+        'RS': 72,
+        'GR': 73,
+        'SE': 74,
+        'TR': 75,
+        'NO': 76,
+        'HR': 78,
+        'SI': 79,
+        'DE': 80,
+        'AT': 81,
+        'LU': 82,
+        'IT': 83,
+        'NL': 84,
+        'CH': 85,
+        'DK': 86,
+        'FR': 87,
+        'BE': 88,
+        'TZ': 89,
+        'EG': 90,
+        'TN': 91,
+        'DZ': 92,
+        'MA': 93,
+        'PT': 94,
+        'IL': 95,
+        'IR': 96,
+        'SY': 97,
+        'LB': 98,
+        'IQ': 99,
+}
+
+
+def get_country_code(country):
+    country = country.upper()
+    if country in UIC_COUNTRY_CODES:
+        country = str(UIC_COUNTRY_CODES[country])
+    return country
+
+
+def resolve_searchdate(searchdate=None):
+    # returns: ISO date for None (today), a relative "+1"/"-1" day offset,
+    #          or an ISO date (passed through)
+    if not searchdate:
+        searchdate = datetime.now(ZoneInfo("Europe/Berlin")).date().isoformat()
+    elif searchdate.startswith('-') or searchdate.startswith('+'):
+        searchdate = offset_date(datetime.now(ZoneInfo("Europe/Berlin")).date(), parse_offset(searchdate)).isoformat()
+    return searchdate
+
+
+def parse_offset(text):
+    # returns: a day offset like "+1" or "-2" as int; raises ValueError if it
+    #          isn't one or is further away than MAX_DAY_OFFSET
+    offset = int(text)
+    if abs(offset) > MAX_DAY_OFFSET:
+        raise ValueError('day offset out of range')
+    return offset
+
+
+def offset_date(base, offset):
+    # returns: base + offset days; raises ValueError (instead of
+    #          OverflowError) beyond the year 9999
+    try:
+        return base + timedelta(days=offset)
+    except OverflowError as e:
+        raise ValueError(str(e))
+
+
+def expand_searchdates(searchdate=None, days=None):
+    # returns: list of ISO dates to search, given a base date (see
+    #          resolve_searchdate) and optionally a list of day offsets
+    #          relative to it, e.g. "-1..+1", "-1,+1" or "+2"
+    searchdate = resolve_searchdate(searchdate)
+    if not days:
+        return [searchdate]
+
+    offsets = set()
+    for part in days.split(','):
+        if '..' in part:
+            first, last = part.split('..', 1)
+            first, last = parse_offset(first), parse_offset(last)
+            # (checked before the range is built)
+            if last - first + 1 > MAX_SEARCHDATES:
+                raise ValueError('too many days')
+            offsets.update(range(first, last + 1))
+        else:
+            offsets.add(parse_offset(part))
+        if len(offsets) > MAX_SEARCHDATES:
+            raise ValueError('too many days')
+
+    if not offsets:
+        raise ValueError('too many days')
+
+    base = date.fromisoformat(searchdate)
+    return [offset_date(base, offset).isoformat() for offset in sorted(offsets)]
+
+
+def _materialize(j, index, memo, pending):
+    # returns: the decoded value of j[index]; lists and dicts are returned
+    #          empty and queued in `pending` to be filled in by the caller
+    if index < 0:
+        return None
+    if index in memo:
+        return memo[index]
+
+    value = j[index]
+    if type(value) == list:
+        output = []
+        pending.append((output, value))
+    elif type(value) == dict:
+        output = dict()
+        pending.append((output, value))
+    elif type(value) in [str, int, float]:
+        output = value
+    else:
+        output = None
+
+    memo[index] = output
+    return output
+
+
+def unravel(j, index=0, memo=None):
+    # "decompress" the weird key-value-indirection JSON from bahn.expert
+    #
+    # Every index is only decoded once; nodes that are referenced from
+    # several places end up as the same (shared) object.  Works iteratively,
+    # so deeply nested payloads can't hit the recursion limit.
+    if memo is None:
+        memo = dict()
+    pending = []
+    output = _materialize(j, index, memo, pending)
+
+    while pending:
+        container, value = pending.pop()
+        if type(container) == list:
+            for item in value:
+                container.append(_materialize(j, item, memo, pending))
+        else:
+            for key, item in value.items():
+                container[key] = _materialize(j, item, memo, pending)
+
+    return output
+
+
+# The parts of each journey that find_country_and_train_journey() looks at:
+# True means "decode this completely", a dict only decodes the listed keys.
+JOURNEY_FIELDS = {
+    'firstStop': {'stopPlace': {'evaNumber': True}},
+    'lastStop': {'stopPlace': {'evaNumber': True}},
+    'train': True,
+    'journeyId': True,
+}
+
+
+def project(j, index, fields, memo=None):
+    # like unravel(), but for dicts only decodes the keys listed in `fields`
+    # (see JOURNEY_FIELDS); lists have `fields` applied to each item
+    if memo is None:
+        memo = dict()
+
+    if fields is True or index < 0:
+        return unravel(j, index, memo)
+
+    value = j[index]
+    if type(value) == list:
+        return [project(j, item, fields, memo) for item in value]
+    elif type(value) == dict:
+        return {
+            key: project(j, value[key], subfields, memo)
+            for key, subfields in fields.items() if key in value
+        }
+    else:
+        return unravel(j, index, memo)
+
+
+def unravel_journeys(j):
+    # decode only what's needed from a journeys.find result
+    return project(j, 0, JOURNEY_FIELDS)
+
+
+def find_country_and_train_journey(journeys, country_code):
+    # country_code: a UIC country code, or a tuple of several
+    # returns: list of tuples (human-readable name, URL)
+    results = []
+    for journey in journeys:
+        if not journey['firstStop']['stopPlace']['evaNumber'].startswith(country_code) \
+           and not journey['lastStop']['stopPlace']['evaNumber'].startswith(country_code):
+            continue
+
+        train = journey['train']
+
+        if 'Bus' in train.get('category', []):
+            continue
+
+        if train.get('name', None):
+            name = train.get('name')
+        else:
+            parts = []
+
+            if train.get('category', None):
+                # add a category if there is one, and it isn't repeated in the line anyway (e.g. "RB RB27")
+                if not train.get('line', None):
+                    parts.append(train.get('category'))
+                elif train.get('line', '').startswith(train.get('category')):
+                    pass
+                else:
+                    parts.append(train.get('category'))
+
+            if train.get('line', None):
+                parts.append(train.get('line'))
+            else:
+                parts.append(str(train.get('journeyNumber')))
+
+            name = ' '.join(parts)
+
+        results.append(
+                (
+                '%s (%s)' % (
+                    name,
+                    train.get('journeyNumber')
+                    ),
+                'https://bahn.expert/details/%s %s/j/%s' % (
+                    train.get('category'),
+                    train.get('journeyNumber'),
+                    journey['journeyId']
+                    )
+                )
+            )
+    return results
+
+
+def rpc_params(journeyNumber, searchdate):
+    # returns: the query parameters for a journeys.find RPC call
+    input_json = json.dumps({
+        "0": json.dumps([
+                {'journeyNumber': 1, 'initialDepartureDate': 2, 'withOEV': 3},
+                journeyNumber, ['Date', searchdate], False
+        ])
+    })
+    return {
+        'batch': 1,
+        'input': input_json,
+    }
+
+
+def parse_rpc_response(data):
+    # returns: the raw (still index-indirected) JSON data from the decoded
+    #          response body of a journeys.find RPC call
+    return json.loads(data[0]['result']['data'])
+
+
+def collect_results(results, errors):
+    # returns: the results (list of (searchdate, JSON data) for the dates
+    #          that could be queried), or raises the last of the errors if
+    #          none could
+    for e in errors:
+        eventlog.log('bahnexpert_error', error=str(e) or repr(e))
+    if not results and errors:
+        raise errors[-1]
+    return results
+
+
+def collect_trains(results, searchdates, countries):
+    # returns: list of tuples (human-readable name, URL) of all journeys in
+    #          the results (see query_many) that begin or end in any of the
+    #          countries, with duplicates from adjacent dates removed
+    country_codes = tuple(get_country_code(country) for country in countries)
+
+    trains = []
+    seen = set()
+    for searchdate, bahnexpert_json in results:
+        journeys = []
+        for journey in unravel_journeys(bahnexpert_json):
+            # the same journey can show up for adjacent dates
+            if journey['journeyId'] in seen:
+                continue
+            seen.add(journey['journeyId'])
+            journeys.append(journey)
+
+        for name, url in find_country_and_train_journey(journeys, country_codes):
+            if len(searchdates) > 1:
+                name = '%s, %s' % (name, searchdate)
+            trains.append((name, url))
+
+    return trains
+
+
+class BahnExpertClient:
+    def __init__(self, connect_timeout=3.05, read_timeout=10, pool_size=10, cache=None):
+        # imported here rather than at the top, so that merely importing this
+        # module stays cheap (see lazy.py)
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache = cache
+
+        # for querying several days in parallel
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size)
+
+        # keep-alive connections to bahn.expert, shared by all worker threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.headers['referer'] = 'https://bahn.expert/'
+
+        # the RPC endpoint that worked last time
+        self.endpoint = RPC_ENDPOINTS[0]
+
+    def query(self, journeyNumber, searchdate=None):
+        # returns: the raw (still index-indirected) JSON data for all journeys
+        #          with this number on that day
+        searchdate = resolve_searchdate(searchdate)
+        if self.cache is None:
+            return self.fetch(journeyNumber, searchdate)
+        return self.cache.get(
+                (journeyNumber, searchdate),
+                lambda: self.fetch(journeyNumber, searchdate)
+                )
+
+    def query_many(self, journeyNumber, searchdates):
+        # returns: list of (searchdate, JSON data) for all dates that could be
+        #          queried, with the queries running in parallel
+        if len(searchdates) == 1:
+            return [(searchdates[0], self.query(journeyNumber, searchdates[0]))]
+
+        futures = [
+                (searchdate, self.executor.submit(self.query, journeyNumber, searchdate))
+                for searchdate in searchdates
+                ]
+
+        results = []
+        errors = []
+        for searchdate, future in futures:
+            try:
+                results.append((searchdate, future.result()))
+            except Exception as e:
+                errors.append(e)
+        return collect_results(results, errors)
+
+    def find_trains(self, journeyNumber, searchdates, countries):
+        # returns: list of tuples (human-readable name, URL) of all journeys
+        #          with this number on any of the dates that begin or end in
+        #          any of the countries
+        return collect_trains(self.query_many(journeyNumber, searchdates), searchdates, countries)
+
+    def fetch(self, journeyNumber, searchdate):
+        params = rpc_params(journeyNumber, searchdate)
+
+        with metrics.upstream_call('bahnexpert', 'rpc'):
+            endpoint = self.endpoint
+            response = self.session.get(RPC_URL % endpoint, params=params, timeout=self.timeout)
+            if response.status_code == 404:
+                # try the other endpoint name(s), and stick with whichever works
+                for fallback in RPC_ENDPOINTS:
+                    if fallback == endpoint:
+                        continue
+                    response = self.session.get(RPC_URL % fallback, params=params, timeout=self.timeout)
+                    if response.status_code != 404:
+                        self.endpoint = fallback
+                        break
+
+            return parse_rpc_response(response.json())
+
+
+class AsyncBahnExpertClient:
+    # Same interface as BahnExpertClient, but with coroutines, so a slow
+    # bahn.expert only holds pending requests instead of worker threads.
+    # The cache can be shared with a BahnExpertClient.
+
+    def __init__(self, connect_timeout=3.05, read_timeout=10, pool_size=10, cache=None):
+        import httpx
+
+        self.cache = cache
+
+        self.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                headers={'referer': 'https://bahn.expert/'},
+                )
+
+        # the RPC endpoint that worked last time
+        self.endpoint = RPC_ENDPOINTS[0]
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def query(self, journeyNumber, searchdate=None):
+        searchdate = resolve_searchdate(searchdate)
+        if self.cache is None:
+            return await self.fetch(journeyNumber, searchdate)
+        return await self.cache.get_async(
+                (journeyNumber, searchdate),
+                lambda: self.fetch(journeyNumber, searchdate)
+                )
+
+    async def query_many(self, journeyNumber, searchdates):
+        answers = await asyncio.gather(
+                *[self.query(journeyNumber, searchdate) for searchdate in searchdates],
+                return_exceptions=True
+                )
+
+        results = []
+        errors = []
+        for searchdate, answer in zip(searchdates, answers):
+            if isinstance(answer, Exception):
+                errors.append(answer)
+            else:
+                results.append((searchdate, answer))
+        return collect_results(results, errors)
+
+    async def find_trains(self, journeyNumber, searchdates, countries):
+        return collect_trains(await self.query_many(journeyNumber, searchdates), searchdates, countries)
+
+    async def fetch(self, journeyNumber, searchdate):
+        params = rpc_params(journeyNumber, searchdate)
+
+        with metrics.upstream_call('bahnexpert', 'rpc'):
+            endpoint = self.endpoint
+            response = await self.client.get(RPC_URL % endpoint, params=params)
+            if response.status_code == 404:
+                for fallback in RPC_ENDPOINTS:
+                    if fallback == endpoint:
+                        continue
+                    response = await self.client.get(RPC_URL % fallback, params=params)
+                    if response.status_code != 404:
+                        self.endpoint = fallback
+                        break
+
+            return parse_rpc_response(response.json())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# encoding: utf-8 (as per PEP 263)
+
+# Load benchmark for the whole app: drives the WSGI application in-process
+# from several threads (like a WSGI server's thread pool) and reports
+# throughput and p50/p95/p99 latency for each class of endpoint.
+#
+# Runs completely offline:
+#
+# - bahn.expert is replaced by a local HTTP server that answers every
+#   journeys.find call with the same (synthetic or recorded) payload,
+# - DNS by a local stub server that makes up PTR and Team Cymru style TXT
+#   answers for any address and ASN.
+#
+# Train numbers and addresses are varied, so the /zug and /ipi caches mostly
+# miss and every request really goes to the stand-ins.  /mac and /gitignore
+# are skipped if data/oui.txt (or data/oui.db) and github-gitignore/ are
+# missing.
+#
+# Usage:
+#   benchmarks/bench_load.py [--seconds 5] [--threads 8] [--journeys response.json] [class ...]
+#
+# (see bench_unravel.py on how to record a journeys.find response)
+
+import argparse
+import http.server
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+
+import bahnexpert
+import quicksearch
+
+from bench_redirects import environ_for
+from bench_unravel import load_recorded, synthetic_payload
+
+# class name -> (lazy.LazyResource the endpoint needs, or None,
+#                function from request number to path)
+ENDPOINT_CLASSES = [
+    ('redirect', None, lambda i: ['/g/velocity of unladen swallow', '/wiki/Monty_Python', '/repo'][i % 3]),
+    ('root', None, lambda i: '/'),
+    ('mac', quicksearch.oui_index, lambda i: '/mac/%02X-%02X-%02X-00-00-01' % (0x00, (i * 7) % 256, (i * 13) % 256)),
+    ('gitignore', quicksearch.gitignore_index, lambda i: ['/gitignore/Python', '/gitignore/Python,Node,macOS'][i % 2]),
+    ('clean', None, lambda i: [
+        '/clean/https://www.google.com/url?sa=t&url=https://www.example.com/page%%3Fparam%%3D%d&usg=x' % i,
+        '/clean/https://www.amazon.de/Some-Product/dp/B074Y6M67F/ref=foo_%d?_encoding=UTF8' % i,
+        '/clean/https://www.example.com/article?id=%d&utm_source=newsletter&fbclid=abc' % i,
+        ][i % 3]),
+    ('zug', quicksearch.bahnexpert_client, lambda i: '/zug/%d' % (10000 + i)),
+    ('ipi', quicksearch.ipinfo_resolver, lambda i: '/ipi/10.%d.%d.%d' % ((i >> 16) % 256, (i >> 8) % 256, i % 256)),
+]
+
+
+def start_fake_bahnexpert(payload):
+    # returns: the RPC URL template of a local server answering every
+    #          journeys.find call with `payload`
+    body = json.dumps([{'result': {'data': json.dumps(payload)}}]).encode('utf-8')
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body are separate writes; with Nagle's algorithm (and
+        # the client's delayed ACKs) every reply would wait ~40 ms
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if self.path.startswith('/rpc/journeys.find'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_error(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%d/rpc/%%s' % server.server_address[1]
+
+
+def stub_answer(name, rdtype):
+    # returns: list of record texts for the query, or None for NXDOMAIN
+    labels = name.rstrip('.').split('.')
+    if rdtype == 'PTR' and name.endswith('.in-addr.arpa.') and len(labels) == 6:
+        return ['host-%s.bench.example.' % '-'.join(reversed(labels[:4]))]
+    if rdtype == 'TXT' and name.endswith('.origin.asn.cymru.com.') and len(labels) == 8:
+        a, b, c = reversed(labels[1:4])
+        return ['"%d | %s.%s.%s.0/24 | ZZ | bench | 2000-01-01"' % (64500 + int(c) % 16, a, b, c)]
+    if rdtype == 'TXT' and name.startswith('AS') and name.endswith('.asn.cymru.com.'):
+        asn = labels[0][2:]
+        return ['"%s | ZZ | bench | 2000-01-01 | BENCH-%s, ZZ"' % (asn, asn)]
+    return None
+
+
+def start_stub_dns():
+    # starts a local DNS server serving stub_answer() and makes it the
+    # default resolver
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+
+    def serve():
+        while True:
+            wire, client = sock.recvfrom(65535)
+            query = dns.message.from_wire(wire)
+            response = dns.message.make_response(query)
+            question = query.question[0]
+            answer = stub_answer(question.name.to_text(), dns.rdatatype.to_text(question.rdtype))
+            if answer is None:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            else:
+                response.answer.append(dns.rrset.from_text_list(question.name, 300, 'IN', question.rdtype, answer))
+            sock.sendto(response.to_wire(), client)
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    stub = dns.resolver.Resolver(configure=False)
+    stub.nameservers = ['127.0.0.1']
+    stub.port = sock.getsockname()[1]
+    dns.resolver.default_resolver = stub
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def run_class(make_path, seconds, threads):
+    # returns: list of the latencies (seconds) of all requests made
+    wsgi_app = quicksearch.app.wsgi_app
+    counter = iter(range(10**9))
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        own = []
+        while time.perf_counter() < deadline:
+            environ = environ_for(make_path(next(counter)))
+            start = time.perf_counter()
+            body = wsgi_app(environ, start_response)
+            b''.join(body)
+            if hasattr(body, 'close'):
+                body.close()
+            own.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(own)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    return latencies
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline load benchmark for quicksearch.')
+    parser.add_argument('--seconds', type=float, default=5.0, help='duration per endpoint class')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent requests')
+    parser.add_argument('--journeys', help='recorded journeys.find response to replay')
+    parser.add_argument('classes', nargs='*', help='endpoint classes to run (default: all)')
+    args = parser.parse_args()
+
+    payload = load_recorded(args.journeys) if args.journeys else synthetic_payload(5, 20, 30)
+    bahnexpert.RPC_URL = start_fake_bahnexpert(payload)
+    start_stub_dns()
+
+    print('%-10s %9s %10s %9s %9s %9s' % ('class', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, resource, make_path in ENDPOINT_CLASSES:
+        if args.classes and name not in args.classes:
+            continue
+        # (loads the resource, so that isn't measured either)
+        if resource is not None and resource.get() is None:
+            print('%-10s skipped (no data)' % name)
+            continue
+
+        # warm up (e.g. build caches that every request would share anyway)
+        b''.join(quicksearch.app.wsgi_app(environ_for(make_path(0)), start_response))
+
+        latencies = sorted(run_class(make_path, args.seconds, args.threads))
+        print('%-10s %9d %10.0f %9.3f %9.3f %9.3f' % (
+            name,
+            len(latencies),
+            len(latencies) / args.seconds,
+            percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.95) * 1000,
+            percentile(latencies, 0.99) * 1000))
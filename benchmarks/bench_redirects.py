@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# encoding: utf-8 (as per PEP 263)
+
+# Measures requests per second for plain keyword redirects, with and without
+# the WSGI-level fast path (providers.RedirectMiddleware), by calling the WSGI
+# application directly (no network, no server overhead), and the cost of the
+# request metrics on top of that.
+#
+# Usage:
+#   benchmarks/bench_redirects.py [seconds per measurement]
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import quicksearch
+
+PATHS = [
+    '/g/velocity of unladen swallow',
+    '/wiki/Monty_Python',
+    '/repo',
+    '/dcc/Schwalbe',
+]
+
+
+def environ_for(path):
+    path, _, query_string = path.partition('?')
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': query_string,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def requests_per_second(wsgi_app, path, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            body = wsgi_app(environ_for(path), start_response)
+            b''.join(body)
+            if hasattr(body, 'close'):
+                body.close()
+        count += 100
+    return count / seconds
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+
+    # with the fast path, requests enter at the middleware; without it, they
+    # go straight to the wrapped application (ProxyFix + Flask), as before.
+    # In production, metrics.MetricsMiddleware and eventlog.EndpointMiddleware
+    # sit in front of both.
+    metered = quicksearch.app.wsgi_app
+    fast = metered.app.app
+    flask = fast.app
+
+    print('%-36s %14s %14s %8s %16s' % ('path', 'Flask req/s', 'fast req/s', 'speedup', '+metrics req/s'))
+    for path in PATHS:
+        before = requests_per_second(flask, path, seconds)
+        after = requests_per_second(fast, path, seconds)
+        with_metrics = requests_per_second(metered, path, seconds)
+        print('%-36s %14.0f %14.0f %7.1fx %16.0f' % (path, before, after, after / before, with_metrics))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# encoding: utf-8 (as per PEP 263)
+
+# Compares the cold start of quicksearch with lazily loaded integrations (the
+# default) and with everything preloaded at import (QUICKSEARCH_PRELOAD=1):
+# time to import the app in a fresh interpreter, total process run time,
+# peak resident memory and the number of loaded modules.
+#
+# Usage:
+#   benchmarks/bench_startup.py [runs per mode]
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+CHILD = '''
+import json, resource, sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+import quicksearch
+seconds = time.perf_counter() - start
+print(json.dumps({
+    'seconds': seconds,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+}))
+''' % ROOT
+
+
+def run_once(preload):
+    env = dict(os.environ)
+    env['QUICKSEARCH_PRELOAD'] = '1' if preload else '0'
+    start = time.perf_counter()
+    output = subprocess.run(
+            [sys.executable, '-c', CHILD],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            ).stdout
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    result['wall'] = time.perf_counter() - start
+    return result
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    print('%-10s %12s %12s %10s %9s' % ('mode', 'import ms', 'process ms', 'RSS MB', 'modules'))
+    for label, preload in [('lazy', False), ('preload', True)]:
+        results = [run_once(preload) for _ in range(runs)]
+        print('%-10s %12.1f %12.1f %10.1f %9d' % (
+            label,
+            statistics.median(r['seconds'] for r in results) * 1000,
+            statistics.median(r['wall'] for r in results) * 1000,
+            statistics.median(r['maxrss_kb'] for r in results) / 1024,
+            statistics.median(r['modules'] for r in results)))
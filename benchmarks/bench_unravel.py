@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# encoding: utf-8 (as per PEP 263)
+
+# Compares the decoders for bahn.expert's index-indirection JSON:
+#
+# - the original recursive decoder (which re-expands shared nodes),
+# - bahnexpert.unravel() (iterative, every index decoded once),
+# - bahnexpert.unravel_journeys() (only the fields /zug/ actually uses).
+#
+# Usage:
+#   benchmarks/bench_unravel.py                      # synthetic payloads
+#   benchmarks/bench_unravel.py response.json ...    # recorded responses
+#
+# Recorded responses can be saved with e.g.
+#   curl -H 'referer: https://bahn.expert/' 'https://bahn.expert/rpc/journeys.find?batch=1&input=...' > response.json
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import bahnexpert
+
+
+def unravel_recursive(j, index=0):
+    # the decoder as it was before bahnexpert.unravel(), for reference
+    if index < 0:
+        return None
+
+    if type(j[index]) == list:
+        output = []
+        for item in j[index]:
+            output.append(unravel_recursive(j, item))
+        return output
+
+    elif type(j[index]) == dict:
+        output = dict()
+        for key, value in j[index].items():
+            output[key] = unravel_recursive(j, value)
+        return output
+
+    elif type(j[index]) in [str, int, float]:
+        return j[index]
+
+
+def synthetic_payload(journeys, stops, stations):
+    # builds a journeys.find-like payload in which every journey has a route
+    # of `stops` stops, all referring to a shared pool of `stations` nodes
+    j = [None]
+
+    def add(value):
+        j.append(value)
+        return len(j) - 1
+
+    station_indices = []
+    for i in range(stations):
+        station_indices.append(add({
+            'evaNumber': add('80%05d' % i),
+            'name': add('Station %d' % i),
+            'position': add({'latitude': add(50.0 + i / 1000), 'longitude': add(8.0 + i / 1000)}),
+        }))
+
+    journey_indices = []
+    for n in range(journeys):
+        route = []
+        for s in range(stops):
+            route.append(add({
+                'stopPlace': station_indices[(n + s) % stations],
+                'cancelled': add(False),
+                'arrival': add({'scheduledTime': add('2026-01-01T%02d:%02d:00' % (s % 24, n % 60))}),
+            }))
+        route_index = add(route)
+        train = add({
+            'category': add('ICE'),
+            'journeyNumber': add(100 + n),
+            'line': add('ICE %d' % (100 + n)),
+        })
+        journey_indices.append(add({
+            'firstStop': j[route_index][0],
+            'lastStop': j[route_index][-1],
+            'stops': route_index,
+            'train': train,
+            'journeyId': add('journey-%d' % n),
+        }))
+
+    j[0] = journey_indices
+    return j
+
+
+def load_recorded(path):
+    with open(path, 'r') as f:
+        data = json.load(f)
+    # either the complete RPC response, or just the data part
+    if isinstance(data, list) and data and isinstance(data[0], dict) and 'result' in data[0]:
+        data = json.loads(data[0]['result']['data'])
+    return data
+
+
+def bench(name, payload, number):
+    print('%s (%d nodes):' % (name, len(payload)))
+    for label, function in [
+            ('recursive', unravel_recursive),
+            ('unravel', bahnexpert.unravel),
+            ('unravel_journeys', bahnexpert.unravel_journeys),
+            ]:
+        try:
+            seconds = min(timeit.repeat(lambda: function(payload), number=number, repeat=3)) / number
+            print('  %-18s %10.3f ms' % (label, seconds * 1000))
+        except RecursionError:
+            print('  %-18s   RecursionError' % label)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            bench(path, load_recorded(path), 10)
+    else:
+        bench('small: 5 journeys x 20 stops', synthetic_payload(5, 20, 30), 200)
+        bench('large: 50 journeys x 60 stops', synthetic_payload(50, 60, 200), 20)
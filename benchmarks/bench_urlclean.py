@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# encoding: utf-8 (as per PEP 263)
+
+# Micro-benchmark and ReDoS check for the URL cleaning rules in urlclean.py.
+#
+# For every rule, this times urlclean.clean_url() on a matching example URL,
+# and then feeds the rule's pattern adversarial inputs of doubling length.
+# Linear patterns take about twice as long per doubling; anything that grows
+# much faster (catastrophic backtracking) is reported as a failure, and the
+# script exits non-zero.
+#
+# Usage:
+#   benchmarks/bench_urlclean.py
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import urlclean
+
+EXAMPLES = {
+    'google_redirect': 'https://www.google.com/url?sa=t&source=web&rct=j&url=https://www.example.com/page%3Fparam%3Dvalue&ved=2ahUKEwiY3OaWh-XpAhXytYsKHZSOBaAQwqsBMAF6BAgHEAg&usg=AOvVaw2r6f5XJRxROXt-aRr_r3lI',
+    'google_amp': 'https://www.google.com/amp/s/www.golem.de/news/fuzzing-wie-man-heartbleed-haette-finden-koennen-1504-113345.amp.html',
+    'amazon_product': 'https://www.amazon.de/DSLRKIT-Ethernet-Splitter-Development-Raspberry/dp/B074Y6M67F/ref=foo_bar_1234_0?_encoding=UTF8&etcpp',
+}
+
+# repeated to build the adversarial part of the input
+FILLERS = ['a', '/', '&', '=', '%', 'url', 'url=', 'dp/', 'amp', '-amp', '.amp', 'B074Y6M67F']
+
+LENGTHS = [2000, 4000, 8000, 16000]
+
+# maximum tolerated slowdown per doubling of the input length
+MAX_GROWTH = 3.0
+
+
+def best_time(function, number=20):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+
+def check_rule(name, hosts, pattern):
+    compiled = re.compile(pattern)
+    failures = []
+    for host in hosts:
+        host = host.replace('*', 'de')
+        for prefix in ['https://%s/' % host, 'https://%s/url?' % host, 'https://%s/amp/s/' % host]:
+            for filler in FILLERS:
+                times = []
+                for length in LENGTHS:
+                    text = prefix + filler * (length // len(filler))
+                    times.append(best_time(lambda: compiled.match(text), number=5))
+                growth = max(b / max(a, 1e-7) for a, b in zip(times, times[1:]))
+                if growth > MAX_GROWTH and times[-1] > 0.001:
+                    failures.append('%s + %r * n: %.1fx per doubling, %.2f ms at n=%d' % (
+                        prefix, filler, growth, times[-1] * 1000, LENGTHS[-1]))
+    return failures
+
+
+if __name__ == '__main__':
+    failed = False
+
+    print('%-20s %12s' % ('rule', 'clean_url()'))
+    for name, hosts, pattern, transform in urlclean.RULES:
+        example = EXAMPLES.get(name)
+        if example is None:
+            print('%-20s %12s' % (name, 'no example'))
+        else:
+            print('%-20s %9.2f us' % (name, best_time(lambda: urlclean.clean_url(example), number=2000) * 1e6))
+
+    for label, url in [
+            ('tracking params', 'https://www.example.com/article?id=5&utm_source=newsletter&utm_medium=email&fbclid=IwAR0abc'),
+            ('no rule', 'https://www.example.com/article?id=5'),
+            ]:
+        print('%-20s %9.2f us' % (label, best_time(lambda: urlclean.clean_url(url), number=2000) * 1e6))
+
+    print()
+    print('ReDoS check (input lengths %s):' % ', '.join(str(n) for n in LENGTHS))
+    for name, hosts, pattern, transform in urlclean.RULES:
+        failures = check_rule(name, hosts, pattern)
+        print('  %-18s %s' % (name, 'FAIL' if failures else 'ok'))
+        for failure in failures:
+            print('    ' + failure)
+        failed = failed or bool(failures)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,166 @@
+# encoding: utf-8 (as per PEP 263)
+
+# Non-blocking log for quicksearch's request handlers.
+#
+# log() only puts a record into a bounded queue and returns; a background
+# thread takes the records out in batches and writes them to stderr (i.e. the
+# journal, under systemd) as JSON lines, with one write per batch.  If the
+# writer can't keep up (e.g. because journald is applying back-pressure), new
+# records are dropped and counted (see /metrics) rather than making requests
+# wait.
+#
+# Every record carries the endpoint of the request it was logged for (noted
+# in the `endpoint` context variable by quicksearch.py/quicksearch_asgi.py,
+# and cleared around every WSGI request by EndpointMiddleware), and records
+# can be sampled per endpoint, e.g. to log only 1% of the /clean queries:
+#
+#     QUICKSEARCH_LOG_SAMPLE=url_clean=0.01
+
+import atexit
+import contextvars
+import json
+import queue
+import random
+import sys
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+import metrics
+
+# endpoint name of the current request (None outside of requests)
+endpoint = contextvars.ContextVar('endpoint', default=None)
+
+DROPPED = metrics.registry.register(metrics.Counter(
+        'quicksearch_log_records_dropped_total',
+        'Log records dropped because the log queue was full.',
+        ('endpoint',)))
+
+
+def parse_sample_rates(text):
+    # returns: dict endpoint -> fraction of records to keep, from e.g.
+    #          "url_clean=0.01,ip_info=0.5"
+    rates = dict()
+    for item in text.split(','):
+        if item.strip():
+            name, _, rate = item.partition('=')
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class Logger:
+    def __init__(self, maxsize=10000, batch_size=256, sample_rates=None, stream=None):
+        # stream: file to write to (default: sys.stderr at the time of writing)
+        self.batch_size = batch_size
+        self.sample_rates = sample_rates or dict()
+        self.stream = stream
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def log(self, event, **fields):
+        # queues a record {time, endpoint, event, **fields}, unless it's
+        # sampled out or the queue is full
+        current = endpoint.get()
+        rate = self.sample_rates.get(current)
+        if rate is not None and random.random() >= rate:
+            return
+
+        if self._thread is None:
+            self._start()
+
+        try:
+            self._queue.put_nowait((time.time(), current, event, fields))
+        except queue.Full:
+            DROPPED.inc((current or '',))
+
+    def flush(self, timeout=1):
+        # waits (at most `timeout` seconds) until all queued records are written
+        with self._queue.all_tasks_done:
+            self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+    def _start(self):
+        # (in the first process that logs, so this also works for servers
+        # that fork after importing the app)
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='eventlog', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                self._write(batch)
+            except Exception:
+                # nowhere left to complain to
+                pass
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        lines = []
+        for timestamp, current, event, fields in batch:
+            record = {'time': round(timestamp, 3), 'endpoint': current, 'event': event}
+            record.update(fields)
+            lines.append(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+        stream = self.stream or sys.stderr
+        stream.write(''.join(lines))
+        stream.flush()
+
+
+def clear_endpoint():
+    endpoint.set(None)
+
+
+class EndpointMiddleware:
+    # Clears `endpoint` when a request comes in (the Flask app notes the
+    # actual one once it is known) and once its response has been sent, so
+    # that nothing is logged under (and sampled by) the endpoint of the
+    # previous request served by the same thread.  Streamed response bodies
+    # still see the request's endpoint.
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        clear_endpoint()
+        try:
+            body = self.app(environ, start_response)
+        except:
+            clear_endpoint()
+            raise
+
+        if type(body) == list:
+            # already complete (e.g. a RedirectMiddleware response), no need
+            # for the (comparatively slow) wrapper
+            clear_endpoint()
+            return body
+        return ClosingIterator(body, clear_endpoint)
+
+
+logger = Logger()
+
+
+def configure(maxsize=10000, sample_rates=None):
+    # replaces the logger used by log() (see quicksearch.example.conf)
+    global logger
+    logger = Logger(maxsize=maxsize, sample_rates=sample_rates)
+
+
+def log(event, **fields):
+    logger.log(event, **fields)
+
+
+@atexit.register
+def flush():
+    logger.flush()
@@ -0,0 +1,166 @@
+# encoding: utf-8 (as per PEP 263)
+
+# Index of the templates in the github/gitignore submodule for quicksearch's
+# /gitignore/ endpoint.
+#
+# Template names are mapped (case-insensitively) to their paths once, instead
+# of globbing the submodule on every request.  Template contents are read on
+# first use and kept in memory together with a strong ETag.  Merged
+# combinations of several templates are kept in a bounded LRU cache.  All of
+# these are thrown away and rebuilt when the submodule checkout changes.
+
+import functools
+import hashlib
+import os
+
+import reloader
+
+# searched in this order; the first template with a given name wins
+SUBDIRECTORIES = ('', 'Global', 'community')
+
+SUFFIX = '.gitignore'
+
+# number of distinct template combinations to keep merged in memory
+MERGED_CACHE_SIZE = 256
+
+
+def find_checkout_marker(path):
+    # returns: a file that git rewrites on every checkout of `path`, i.e. the
+    #          index file of the submodule's (or regular clone's) git directory
+    git_path = os.path.join(path, '.git')
+    if os.path.isfile(git_path):
+        # submodule: .git is a file containing "gitdir: ../.git/modules/..."
+        with open(git_path, 'r') as f:
+            content = f.read().strip()
+        if content.startswith('gitdir:'):
+            git_path = os.path.join(path, content[len('gitdir:'):].strip())
+    return os.path.join(git_path, 'index')
+
+
+def scan_templates(path):
+    # returns: dict mapping lowercase template name to (name, path)
+    index = dict()
+    for subdirectory in SUBDIRECTORIES:
+        top = os.path.join(path, subdirectory)
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith(SUFFIX):
+                    continue
+                name = filename[:-len(SUFFIX)]
+                index.setdefault(name.lower(), (name, os.path.join(dirpath, filename)))
+            if not subdirectory:
+                # the root directory's subdirectories are handled separately
+                break
+    return index
+
+
+def read_template(index, cache, key):
+    # returns: (template name, content bytes, ETag) or None if not found
+    entry = index.get(key)
+    if entry is None:
+        return None
+
+    name, path = entry
+    cached = cache.get(path)
+    if cached is None:
+        with open(path, 'rb') as f:
+            content = f.read()
+        cached = (name, content, hashlib.sha1(content).hexdigest())
+        # plain dict assignment is atomic; a concurrent duplicate read of the
+        # same template is harmless
+        cache[path] = cached
+
+    return cached
+
+
+def merge_templates(templates):
+    # templates: list of (template name, content bytes, ETag)
+    # returns: (content bytes, ETag) of all templates concatenated, in the
+    #          given order, each with a section header, and with patterns
+    #          that already appeared earlier left out where that doesn't
+    #          change what is ignored
+    #
+    # The last matching pattern decides whether a path is ignored, so a
+    # repeated pattern is only redundant if no pattern of the opposite kind
+    # (negated "!..." or not) came between the two.
+    seen = dict()
+    last = {True: -1, False: -1}
+    output = []
+    for name, content, etag in templates:
+        if output:
+            output.append(b'')
+        output.append(('### %s ###' % name).encode('utf-8'))
+        for line in content.splitlines():
+            pattern = line.strip()
+            if pattern and not pattern.startswith(b'#'):
+                negated = pattern.startswith(b'!')
+                if seen.get(pattern, -1) > last[not negated]:
+                    continue
+                seen[pattern] = last[negated] = len(output)
+            output.append(line.rstrip())
+    content = b'\n'.join(output) + b'\n'
+    return (content, hashlib.sha1(content).hexdigest())
+
+
+class GitignoreIndex:
+    def __init__(self, path):
+        self.path = path
+        self.marker = find_checkout_marker(path)
+        # (name index, content cache, merge function), rebuilt on checkout
+        self._reloader = reloader.Reloader(self._signature, self._build)
+
+    def _signature(self):
+        # the git index file changes on every checkout; fall back to the
+        # directory mtime for a plain copy without git metadata
+        for path in (self.marker, self.path):
+            try:
+                st = os.stat(path)
+                return (path, st.st_mtime_ns, st.st_size)
+            except OSError:
+                continue
+        return None
+
+    def _build(self, previous):
+        index = scan_templates(self.path)
+        cache = dict()
+
+        @functools.lru_cache(maxsize=MERGED_CACHE_SIZE)
+        def merge(keys):
+            return merge_templates([read_template(index, cache, key) for key in keys])
+
+        return (index, cache, merge)
+
+    def reload(self):
+        return self._reloader.get()
+
+    def get(self, name):
+        # returns: (template name, content bytes, ETag) or None if not found
+        index, cache, merge = self.reload()
+        return read_template(index, cache, name.lower())
+
+    def split_names(self, query):
+        # returns: list of the template names in e.g. "Python,Node,macOS" or
+        #          "Python+Node+macOS"; names that themselves contain "+"
+        #          (C++) are kept in one piece
+        index, cache, merge = self.reload()
+        names = []
+        for part in query.split(','):
+            if part.lower() in index:
+                names.append(part)
+            else:
+                names += [name for name in part.split('+') if name]
+        return names
+
+    def get_merged(self, names):
+        # returns: (content bytes, ETag) of the named templates merged into one
+        #          file (in that order), or None if any of them doesn't exist
+        index, cache, merge = self.reload()
+
+        # normalized so that e.g. "python,node" and "Python+Node+python" share
+        # the same cache entry
+        keys = tuple(dict.fromkeys(name.lower() for name in names))
+        if not all(key in index for key in keys):
+            return None
+
+        return merge(keys)
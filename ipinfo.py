@@ -0,0 +1,403 @@
+# encoding: utf-8 (as per PEP 263)
+
+# PTR and Team Cymru IP-to-ASN lookups for quicksearch's /ipi endpoints.
+#
+# The PTR and origin queries for an address are sent concurrently, and the
+# AS name queries are fanned out in parallel as soon as the origin answer
+# arrives.  All queries for one address share an overall deadline, so a
+# single slow nameserver can't stall the response.
+#
+# Answers can be cached according to their TTL (clamped to a configurable
+# range); NXDOMAIN, empty answers and timeouts are cached for a short
+# negative TTL, so unresolvable names don't cost a resolver timeout each time
+# (but not timeouts caused by a lookup's own deadline cutting a query short).
+#
+# If a local asndb.ASNDatabase is given, origin and AS name queries are
+# answered from it, and Cymru's DNS service is only used for prefixes and
+# ASNs that it doesn't cover.
+#
+# The describe*_async() methods do the same with dnspython's asyncio resolver
+# instead of worker threads (see quicksearch_asgi.py).
+
+import asyncio
+import collections
+import concurrent.futures
+import ipaddress
+import threading
+import time
+
+import dns.exception
+from dns import resolver
+try:
+    from dns import asyncresolver
+except ImportError:
+    # dnspython < v2.0.0; only needed for the async methods
+    asyncresolver = None
+
+import eventlog
+import metrics
+import ttlcache
+
+# approximate compatibility (different search list behaviour) with dnspython < v2.0.0
+if not hasattr(resolver, 'resolve'):
+    resolver.resolve = resolver.query
+
+NO_INFORMATION = 'No information available'
+INVALID_ADDRESS = 'Error | %s | Invalid input (not an IP address)'
+
+# failures that are cached (for the negative TTL) instead of retried right away
+CACHEABLE_ERRORS = (
+        resolver.NXDOMAIN,
+        resolver.NoAnswer,
+        resolver.NoNameservers,
+        dns.exception.Timeout,
+        )
+
+
+def cymru_origin_name(addr):
+    return addr.reverse_pointer \
+        .replace('.ip6.arpa', '.origin6.asn.cymru.com') \
+        .replace('.in-addr.arpa', '.origin.asn.cymru.com')
+
+
+def completed_future(result):
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+def origin_asns(text):
+    # "3320 | 193.158.0.0/15 | DE | ripencc | 1993-09-01" -> [3320]
+    # (multi-origin prefixes list several ASNs in the first field)
+    asns = []
+    for asn in text.split('|')[0].split():
+        try:
+            asns.append(int(asn))
+        except:
+            # skip non-numerical data (it's probably an error message)
+            continue
+    return asns
+
+
+def reusable(future, deadline):
+    # returns: whether a query (future or task) sent for an earlier lookup
+    #          can also answer a later one, i.e. it didn't fail and won't
+    #          run into its own (earlier) deadline
+    if future.done():
+        return not future.cancelled() and future.exception() is None
+    return deadline > time.monotonic()
+
+
+def start_task(coroutine):
+    task = asyncio.ensure_future(coroutine)
+    # nobody looks at the result any more once the deadline has passed
+    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return task
+
+
+def unmap(addr):
+    # returns: the IPv4 address for an IPv4-mapped IPv6 address, else addr
+    if type(addr) == ipaddress.IPv6Address and addr.ipv4_mapped:
+        return addr.ipv4_mapped
+    return addr
+
+
+def summary_line(addr, ptrs):
+    if addr.version == 4:
+        addr_version = 'IPv4'
+    elif addr.version == 6:
+        addr_version = 'IPv6'
+    else:
+        addr_version = 'Address version unknown'
+
+    return '%s | %s | %s' % (
+        addr_version,
+        str(addr),
+        '+'.join(ptrs))
+
+
+class IPInfoResolver:
+    def __init__(self, deadline=5.0, pool_size=16,
+                 cache_size=4096, min_ttl=30, max_ttl=86400, negative_ttl=60,
+                 asn_db=None):
+        self.deadline = deadline
+        self.asn_db = asn_db
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size)
+        self._asn_lock = threading.Lock()
+
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        if cache_size:
+            self.cache = ttlcache.TTLCache(maxsize=cache_size, ttl_func=lambda result: result[1])
+        else:
+            self.cache = None
+
+    def lifetime(self, deadline):
+        # returns: the time left until deadline; raises Timeout (which isn't
+        #          cached) if there is none, e.g. because the query waited
+        #          for a worker thread for that long
+        lifetime = deadline - time.monotonic()
+        if lifetime <= 0:
+            raise dns.exception.Timeout(timeout=0)
+        return lifetime
+
+    def failure_result(self, e, lifetime, default_resolver):
+        # returns: (exception, negative TTL) for a failure worth caching;
+        #          re-raises timeouts of queries that were cut short by our
+        #          own deadline, rather than the nameservers being slow
+        if isinstance(e, dns.exception.Timeout) and lifetime < min(default_resolver.timeout, self.deadline):
+            raise e
+        return (e, self.negative_ttl)
+
+    def resolve(self, name, rdtype, deadline):
+        # returns: (list of the answer's records as text, TTL to cache it for)
+        #          or (exception, negative TTL) for failures worth caching
+        lifetime = self.lifetime(deadline)
+        try:
+            with metrics.upstream_call('dns', rdtype):
+                answer = resolver.resolve(name, rdtype, lifetime=lifetime)
+        except CACHEABLE_ERRORS as e:
+            return self.failure_result(e, lifetime, resolver.get_default_resolver())
+        return self.answer_result(answer, rdtype)
+
+    async def resolve_async(self, name, rdtype, deadline):
+        lifetime = self.lifetime(deadline)
+        try:
+            with metrics.upstream_call('dns', rdtype):
+                answer = await asyncresolver.resolve(name, rdtype, lifetime=lifetime)
+        except CACHEABLE_ERRORS as e:
+            return self.failure_result(e, lifetime, asyncresolver.get_default_resolver())
+        return self.answer_result(answer, rdtype)
+
+    def answer_result(self, answer, rdtype):
+        texts = [
+                record.to_text() if rdtype == 'PTR' else str(record).strip('"')
+                for record in answer
+                ]
+        return (texts, min(max(answer.rrset.ttl, self.min_ttl), self.max_ttl))
+
+    def query(self, name, rdtype, deadline):
+        # returns: list of the answer's records as text
+        if self.cache is None:
+            result = self.resolve(name, rdtype, deadline)
+        else:
+            result = self.cache.get(
+                    (name, rdtype),
+                    lambda: self.resolve(name, rdtype, deadline)
+                    )
+
+        if isinstance(result[0], Exception):
+            raise result[0]
+        return result[0]
+
+    async def query_async(self, name, rdtype, deadline):
+        if self.cache is None:
+            result = await self.resolve_async(name, rdtype, deadline)
+        else:
+            result = await self.cache.get_async(
+                    (name, rdtype),
+                    lambda: self.resolve_async(name, rdtype, deadline)
+                    )
+
+        if isinstance(result[0], Exception):
+            raise result[0]
+        return result[0]
+
+    def submit(self, name, rdtype, deadline):
+        return self.executor.submit(self.query, name, rdtype, deadline)
+
+    def wait(self, future, deadline, fallback):
+        # returns: the future's result, or `fallback` if it failed or
+        #          didn't finish before the deadline
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except Exception as e:
+            eventlog.log('dns_error', error=str(e) or repr(e))
+            return fallback
+
+    async def wait_async(self, task, deadline, fallback):
+        try:
+            # the task itself isn't cancelled on timeout, it may be shared
+            return await asyncio.wait_for(asyncio.shield(task), max(deadline - time.monotonic(), 0))
+        except Exception as e:
+            eventlog.log('dns_error', error=str(e) or repr(e))
+            return fallback
+
+    def local_origin(self, addr):
+        # returns: the origin answer for addr from the local ASN database
+        #          (same layout as Cymru's, minus the fields we don't know),
+        #          or None
+        origin = self.asn_db.origin(addr) if self.asn_db is not None else None
+        if origin is None:
+            return None
+        prefix, asns = origin
+        return ['%s | %s' % (' '.join(str(asn) for asn in asns), prefix)]
+
+    def local_as_name(self, asn):
+        # returns: the AS name answer for asn from the local ASN database, or None
+        name = self.asn_db.name(asn) if self.asn_db is not None else None
+        if name is None:
+            return None
+        return ['%d | %s' % (asn, name)]
+
+    def _asn_future(self, asn, deadline, asn_futures):
+        # asn_futures: dict ASN -> (future, deadline) of the AS name queries
+        #              already sent for this lookup (or batch of lookups), so
+        #              each ASN is only queried once (unless that query
+        #              failed or ran out of time before this lookup's did)
+        with self._asn_lock:
+            entry = asn_futures.get(asn)
+            if entry is None or not reusable(*entry):
+                name = self.local_as_name(asn)
+                if name is not None:
+                    future = completed_future(name)
+                else:
+                    future = self.submit('AS%d.asn.cymru.com' % asn, 'TXT', deadline)
+                entry = asn_futures[asn] = (future, deadline)
+        return entry[0]
+
+    def _start(self, addr, asn_futures):
+        # sends the PTR and origin queries for addr, and the AS name queries
+        # as soon as the origin answer is in
+        addr = unmap(addr)
+
+        deadline = time.monotonic() + self.deadline
+
+        ptr_future = self.submit(addr.reverse_pointer, 'PTR', deadline)
+
+        origin = self.local_origin(addr)
+        if origin is not None:
+            origin_future = completed_future(origin)
+        else:
+            origin_future = self.submit(cymru_origin_name(addr), 'TXT', deadline)
+
+        def submit_asn_queries(future):
+            if future.exception() is not None:
+                return
+            for text in future.result():
+                for asn in origin_asns(text):
+                    self._asn_future(asn, deadline, asn_futures)
+
+        origin_future.add_done_callback(submit_asn_queries)
+
+        return (addr, deadline, ptr_future, origin_future)
+
+    def _finish(self, lookup, asn_futures):
+        # returns: list of output lines for /ipi
+        addr, deadline, ptr_future, origin_future = lookup
+
+        origins = self.wait(origin_future, deadline, [NO_INFORMATION])
+        ptrs = self.wait(ptr_future, deadline, ['no PTR'])
+
+        result = [summary_line(addr, ptrs)]
+        for text in origins:
+            result.append(text)
+            for asn in origin_asns(text):
+                future = self._asn_future(asn, deadline, asn_futures)
+                result += self.wait(future, deadline, [NO_INFORMATION])
+
+        return result
+
+    def describe(self, addr):
+        # returns: list of output lines for /ipi
+        asn_futures = dict()
+        return self._finish(self._start(addr, asn_futures), asn_futures)
+
+    def describe_many(self, addrs, window=32):
+        # yields: list of output lines for /ipi for each of the addresses
+        #         (strings), in order, with up to `window` addresses being
+        #         looked up at the same time and every ASN only queried once
+        asn_futures = dict()
+        lookups = collections.deque()
+
+        def finish(lookup):
+            if type(lookup) == str:
+                return [INVALID_ADDRESS % lookup]
+            return self._finish(lookup, asn_futures)
+
+        for addr in addrs:
+            try:
+                lookups.append(self._start(ipaddress.ip_address(addr), asn_futures))
+            except ValueError:
+                lookups.append(addr)
+
+            if len(lookups) >= window:
+                yield finish(lookups.popleft())
+
+        while lookups:
+            yield finish(lookups.popleft())
+
+    def _asn_task(self, asn, deadline, asn_tasks):
+        # like _asn_future(), for the async lookups (no lock needed, they
+        # all run in the same event loop)
+        entry = asn_tasks.get(asn)
+        if entry is None or not reusable(*entry):
+            name = self.local_as_name(asn)
+            if name is not None:
+                task = asyncio.get_running_loop().create_future()
+                task.set_result(name)
+            else:
+                task = start_task(self.query_async('AS%d.asn.cymru.com' % asn, 'TXT', deadline))
+            entry = asn_tasks[asn] = (task, deadline)
+        return entry[0]
+
+    def _start_async(self, addr, asn_tasks):
+        addr = unmap(addr)
+
+        deadline = time.monotonic() + self.deadline
+
+        async def origin():
+            answer = self.local_origin(addr)
+            if answer is None:
+                answer = await self.query_async(cymru_origin_name(addr), 'TXT', deadline)
+            for text in answer:
+                for asn in origin_asns(text):
+                    self._asn_task(asn, deadline, asn_tasks)
+            return answer
+
+        ptr_task = start_task(self.query_async(addr.reverse_pointer, 'PTR', deadline))
+        origin_task = start_task(origin())
+
+        return (addr, deadline, ptr_task, origin_task)
+
+    async def _finish_async(self, lookup, asn_tasks):
+        addr, deadline, ptr_task, origin_task = lookup
+
+        origins = await self.wait_async(origin_task, deadline, [NO_INFORMATION])
+        ptrs = await self.wait_async(ptr_task, deadline, ['no PTR'])
+
+        result = [summary_line(addr, ptrs)]
+        for text in origins:
+            result.append(text)
+            for asn in origin_asns(text):
+                task = self._asn_task(asn, deadline, asn_tasks)
+                result += await self.wait_async(task, deadline, [NO_INFORMATION])
+
+        return result
+
+    async def describe_async(self, addr):
+        asn_tasks = dict()
+        return await self._finish_async(self._start_async(addr, asn_tasks), asn_tasks)
+
+    async def describe_many_async(self, addrs, window=32):
+        # async generator version of describe_many()
+        asn_tasks = dict()
+        lookups = collections.deque()
+
+        async def finish(lookup):
+            if type(lookup) == str:
+                return [INVALID_ADDRESS % lookup]
+            return await self._finish_async(lookup, asn_tasks)
+
+        for addr in addrs:
+            try:
+                lookups.append(self._start_async(ipaddress.ip_address(addr), asn_tasks))
+            except ValueError:
+                lookups.append(addr)
+
+            if len(lookups) >= window:
+                yield await finish(lookups.popleft())
+
+        while lookups:
+            yield await finish(lookups.popleft())
@@ -0,0 +1,80 @@
+# encoding: utf-8 (as per PEP 263)
+
+# On-demand loading of quicksearch's optional integrations (heavy modules
+# like requests, dnspython or phonenumbers, and data files like the OUI
+# registry), so that starting a worker doesn't wait for features that it may
+# never use.  The routes are always registered; their backing resource is
+# loaded by the first request that needs it, or ahead of time by preload().
+
+import importlib.util
+import threading
+
+import eventlog
+
+# every LazyResource, in creation order (for preload())
+resources = []
+
+
+class LazyResource:
+    # load: function returning the resource, or None if the feature isn't
+    #       available (e.g. because a data file is missing); it runs at most
+    #       once, and if it raises, `message` is logged and the feature stays
+    #       disabled (just as if the import had failed at startup)
+    # probe: optional cheap function telling whether load() can succeed at
+    #        all (e.g. whether the modules or files it needs exist), without
+    #        actually loading anything
+
+    def __init__(self, load, message=None, probe=None):
+        self.load = load
+        self.message = message
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+        self._probed = None
+        resources.append(self)
+
+    def get(self):
+        # returns: the resource, or None if it isn't available
+        if self._loaded:
+            return self._value
+
+        with self._lock:
+            if not self._loaded:
+                try:
+                    self._value = self.load()
+                except Exception as e:
+                    eventlog.log('load_error',
+                            message=self.message or 'Could not load %s' % self.load.__name__,
+                            error=str(e) or repr(e))
+                    self._value = None
+                self._loaded = True
+
+        return self._value
+
+    def get_if_loaded(self):
+        # returns: the resource if it has been loaded already, else None
+        return self._value if self._loaded else None
+
+    def available(self):
+        # returns: False if the resource is known to be unavailable (it
+        #          couldn't be loaded, or the probe says it couldn't), else
+        #          True; never loads it
+        if self._loaded:
+            return self._value is not None
+        if self.probe is not None and self._probed is None:
+            # (once; the modules and files don't come and go while running)
+            self._probed = bool(self.probe())
+        return self._probed is not False
+
+
+def modules_exist(*names):
+    # returns: a probe checking whether the named top-level modules can be
+    #          found (without importing them)
+    return lambda: all(importlib.util.find_spec(name) is not None for name in names)
+
+
+def preload():
+    # loads all resources right away (warm-up)
+    for resource in resources:
+        resource.get()
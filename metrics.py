@@ -0,0 +1,243 @@
+# encoding: utf-8 (as per PEP 263)
+
+# In-process request and upstream call metrics for quicksearch's /metrics
+# endpoint, in the Prometheus text exposition format (version 0.0.4).
+#
+# Every thread counts into its own shard (a plain dict it alone writes to),
+# so recording a value never takes a lock; only a thread's first
+# observation registers its shard.  The shards are summed up when /metrics
+# is scraped, which may miss observations that are happening at that very
+# moment, but never counts anything twice.  When a thread ends, its shard is
+# folded into a shared total, so short-lived threads (e.g. the cache's
+# background refreshes) don't pile up shards.
+
+import bisect
+import contextlib
+import threading
+import time
+import weakref
+
+# upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# WSGI environ key under which the Flask endpoint name is noted
+ENDPOINT_KEY = 'quicksearch.endpoint'
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    labels = ['%s="%s"' % (name, escape_label_value(value)) for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(labels)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if type(value) == float and value.is_integer() and abs(value) < 2**53:
+        return str(int(value))
+    return repr(value)
+
+
+class _ThreadToken:
+    # kept in a thread's local storage only, so it is garbage collected (and
+    # its finalizer called) when the thread ends
+    __slots__ = ('__weakref__',)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        # totals of the shards of threads that have ended
+        self._retired = dict()
+        self._shards_lock = threading.Lock()
+
+    def _new_shard(self):
+        # returns: a new dict of label values -> counts for this thread
+        shard = self._local.shard = dict()
+        token = self._local.token = _ThreadToken()
+        weakref.finalize(token, self._retire, shard).atexit = False
+        with self._shards_lock:
+            self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._shards_lock:
+            self._merge(self._retired, shard)
+            # (by identity; shards with the same counts compare equal)
+            self._shards = [s for s in self._shards if s is not shard]
+
+    def _totals(self):
+        # returns: dict of label values -> summed up counts of all shards
+        with self._shards_lock:
+            totals = dict()
+            self._merge(totals, self._retired)
+            shards = list(self._shards)
+        for shard in shards:
+            self._merge(totals, shard)
+        return totals
+
+    def render(self):
+        lines = [
+                '# HELP %s %s' % (self.name, self.documentation),
+                '# TYPE %s %s' % (self.name, self.kind),
+                ]
+        return lines + self._render_samples()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labelvalues=(), amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def _merge(self, totals, shard):
+        for labelvalues, value in list(shard.items()):
+            totals[labelvalues] = totals.get(labelvalues, 0) + value
+
+    def _render_samples(self):
+        totals = self._totals()
+        return [
+                '%s%s %s' % (self.name, format_labels(self.labelnames, labelvalues), format_value(value))
+                for labelvalues, value in sorted(totals.items())
+                ]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labelvalues, value):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        # per-bucket (not yet cumulative) counts, then the sum of all values
+        counts = shard.get(labelvalues)
+        if counts is None:
+            counts = shard[labelvalues] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, totals, shard):
+        for labelvalues, counts in list(shard.items()):
+            total = totals.get(labelvalues)
+            if total is None:
+                total = totals[labelvalues] = [0] * len(counts)
+            for i, count in enumerate(list(counts)):
+                total[i] += count
+
+    def _render_samples(self):
+        totals = self._totals()
+        lines = []
+        for labelvalues, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    format_labels(self.labelnames, labelvalues, 'le="%s"' % format_value(float(bound))),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (self.name, format_labels(self.labelnames, labelvalues), format_value(float(counts[-1]))))
+            lines.append('%s_count%s %d' % (self.name, format_labels(self.labelnames, labelvalues), cumulative))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # returns: all metrics in the Prometheus text format
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+        'quicksearch_http_requests_total',
+        'HTTP requests by endpoint and status code.',
+        ('endpoint', 'status')))
+REQUEST_DURATION = registry.register(Histogram(
+        'quicksearch_http_request_duration_seconds',
+        'Time until the response (headers) was ready, by endpoint.',
+        ('endpoint',)))
+UPSTREAM_DURATION = registry.register(Histogram(
+        'quicksearch_upstream_call_duration_seconds',
+        'Duration of outbound calls and data file lookups.',
+        ('upstream', 'operation')))
+UPSTREAM_ERRORS = registry.register(Counter(
+        'quicksearch_upstream_call_errors_total',
+        'Failed outbound calls and data file lookups.',
+        ('upstream', 'operation')))
+
+
+@contextlib.contextmanager
+def upstream_call(upstream, operation):
+    # times the enclosed call and counts it as failed if it raises
+    labelvalues = (upstream, operation)
+    start = time.perf_counter()
+    try:
+        yield
+    except:
+        UPSTREAM_ERRORS.inc(labelvalues)
+        raise
+    finally:
+        UPSTREAM_DURATION.observe(labelvalues, time.perf_counter() - start)
+
+
+def record_request(endpoint, status, duration):
+    REQUESTS.inc((endpoint, status))
+    REQUEST_DURATION.observe((endpoint,), duration)
+
+
+class MetricsMiddleware:
+    # Records every request that reaches the wrapped WSGI app, labelled with
+    # the endpoint name found in environ[ENDPOINT_KEY] (see quicksearch.py),
+    # or `default_endpoint` for requests that never got that far.
+
+    def __init__(self, app, default_endpoint):
+        self.app = app
+        self.default_endpoint = default_endpoint
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        status = ['500']
+
+        def recording_start_response(status_line, headers, exc_info=None):
+            status[0] = status_line[:3]
+            return start_response(status_line, headers, exc_info)
+
+        try:
+            return self.app(environ, recording_start_response)
+        finally:
+            record_request(
+                    environ.get(ENDPOINT_KEY, self.default_endpoint),
+                    status[0],
+                    time.perf_counter() - start)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# encoding: utf-8 (as per PEP 263)
+
+# IEEE MAC address block registry lookups for quicksearch's /mac/ and /oui/.
+#
+# Two interchangeable backends are provided:
+#
+# - OUIDatabase memory-maps a compact binary file compiled from the IEEE
+#   registry files (MA-L/oui.txt, MA-M/mam.txt, MA-S/oui36.txt, IAB/iab.txt)
+#   by running this module as a script:
+#
+#       python3 ouidb.py data/oui.db data/oui.txt data/mam.txt data/oui36.txt data/iab.txt
+#
+#   All worker processes share the same page-cached copy of that file.
+#
+# - OUIIndex parses the text registry files directly into a dict.  It's the
+#   fallback for installations that only downloaded oui.txt.
+#
+# Both are reloaded transparently whenever their file's modification time
+# changes, so refreshing the data does not require a restart.
+#
+# Binary file layout (all integers big-endian):
+#
+#   header:   8s magic, I record count, 4x padding
+#   records:  6s prefix (address with all bits past the prefix zeroed),
+#             B prefix length in bits, 1x padding, I string table offset
+#             -- sorted by (prefix, prefix length)
+#   strings:  H length, followed by that many bytes of UTF-8,
+#             each distinct organization name is stored only once
+
+import abc
+import mmap
+import os
+import re
+import struct
+import sys
+
+import reloader
+
+MAGIC = b'QSOUIDB1'
+HEADER = struct.Struct('>8sI4x')
+RECORD = struct.Struct('>6sBxI')
+STRING_LENGTH = struct.Struct('>H')
+
+# IEEE block sizes, longest first: MA-S/IAB, MA-M, MA-L
+PREFIX_LENGTHS = (36, 28, 24)
+
+# 28-6F-B9   (hex)		Nokia Shanghai Bell Co., Ltd.
+HEX_LINE = re.compile(r'^([0-9A-Fa-f]{2})-([0-9A-Fa-f]{2})-([0-9A-Fa-f]{2})\s+\(hex\)\s+(.*?)\s*$')
+# 286FB9     (base 16)		Nokia Shanghai Bell Co., Ltd.
+# 000000-0FFFFF     (base 16)		Spang Power Electronics
+BASE16_LINE = re.compile(r'^([0-9A-Fa-f]{6})(?:-([0-9A-Fa-f]{6}))?\s+\(base 16\)\s+(.*?)\s*$')
+
+
+def mask_prefix(address, bits):
+    # address: 6 bytes; returns the address with all bits past `bits` zeroed
+    value = int.from_bytes(address, 'big')
+    value &= ((1 << bits) - 1) << (48 - bits)
+    return value.to_bytes(6, 'big')
+
+
+def format_prefix(prefix, bits):
+    # 3C-D9-2B for MA-L blocks, 70-B3-D5-F7-A0-00/36 for everything smaller
+    if bits == 24:
+        return '-'.join('%02X' % b for b in prefix[:3])
+    return '%s/%d' % ('-'.join('%02X' % b for b in prefix), bits)
+
+
+def parse_registry_file(path):
+    # yields: (prefix, prefix length, organization) for every assignment in
+    #         one of IEEE's oui.txt/mam.txt/oui36.txt/iab.txt files
+    oui = None
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            match = HEX_LINE.match(line)
+            if match:
+                oui = bytes.fromhex(''.join(match.group(1, 2, 3)))
+                continue
+
+            match = BASE16_LINE.match(line)
+            if not match or not match.group(3):
+                continue
+
+            if not match.group(2):
+                # MA-L: 286FB9 is the complete OUI
+                yield (bytes.fromhex(match.group(1)) + b'\0\0\0', 24, match.group(3))
+            elif oui:
+                # MA-M/MA-S/IAB: a range below the OUI from the preceding line
+                first = int(match.group(1), 16)
+                size = int(match.group(2), 16) - first + 1
+                bits = 48 - (size.bit_length() - 1)
+                if bits not in PREFIX_LENGTHS:
+                    continue
+                yield (oui + first.to_bytes(3, 'big'), bits, match.group(3))
+
+
+def compile_database(output_path, input_paths):
+    assignments = dict()
+    for path in input_paths:
+        for prefix, bits, organization in parse_registry_file(path):
+            # first entry wins, just like the old linear scan did
+            assignments.setdefault((prefix, bits), organization)
+
+    strings = bytearray()
+    string_offsets = dict()
+    records = []
+    for (prefix, bits), organization in sorted(assignments.items()):
+        if organization not in string_offsets:
+            encoded = organization.encode('utf-8')[:0xFFFF]
+            string_offsets[organization] = len(strings)
+            strings += STRING_LENGTH.pack(len(encoded)) + encoded
+        records.append(RECORD.pack(prefix, bits, string_offsets[organization]))
+
+    # write to a temporary file and rename it into place, so running
+    # instances never map a half-written database
+    temp_path = '%s.tmp%d' % (output_path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        f.write(b''.join(records))
+        f.write(strings)
+    os.replace(temp_path, output_path)
+
+    return len(records), len(string_offsets)
+
+
+class _ReloadingLookup(abc.ABC):
+    # Common base for the two backends: reloads the data whenever the file's
+    # mtime changes (see reloader.py).
+
+    def __init__(self, path):
+        self.path = path
+        self._reloader = reloader.Reloader(self._mtime, self._reload)
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reload(self, previous):
+        # (keeps the previous data while the file is missing)
+        if not os.path.isfile(self.path):
+            return previous
+        return self._load()
+
+    @abc.abstractmethod
+    def _load(self):
+        # returns: the backend's data for _find(), read from self.path
+        pass
+
+    @abc.abstractmethod
+    def _find(self, data, prefix, bits):
+        # returns: the organization assigned exactly (prefix, bits), or None
+        pass
+
+    def reload(self):
+        return self._reloader.get()
+
+    def lookup(self, address, known_bits=48):
+        # address: 6 bytes, of which only the first `known_bits` are valid
+        # returns: (prefix length, organization) of the longest matching
+        #          assignment, (0, '') if the address is unassigned,
+        #          or None if no data could be loaded at all
+        data = self.reload()
+        if data is None:
+            return None
+
+        for bits in PREFIX_LENGTHS:
+            if bits > known_bits:
+                continue
+            organization = self._find(data, mask_prefix(address, bits), bits)
+            if organization is not None:
+                return (bits, organization)
+
+        return (0, '')
+
+
+class OUIIndex(_ReloadingLookup):
+    def _load(self):
+        index = dict()
+        for prefix, bits, organization in parse_registry_file(self.path):
+            index.setdefault((prefix, bits), organization)
+        return index
+
+    def _find(self, index, prefix, bits):
+        return index.get((prefix, bits))
+
+
+class OUIDatabase(_ReloadingLookup):
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a compiled OUI database' % self.path)
+
+        strings_offset = HEADER.size + count * RECORD.size
+        return (data, count, strings_offset)
+
+    def _find(self, database, prefix, bits):
+        data, count, strings_offset = database
+        key = prefix + bytes((bits,))
+        key_length = len(key)
+
+        # binary search over the sorted fixed-width records
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            record_key = data[offset:offset + key_length]
+            if record_key < key:
+                low = middle + 1
+            elif record_key > key:
+                high = middle
+            else:
+                string_offset = strings_offset + RECORD.unpack_from(data, offset)[2]
+                (length,) = STRING_LENGTH.unpack_from(data, string_offset)
+                string_offset += STRING_LENGTH.size
+                return data[string_offset:string_offset + length].decode('utf-8', errors='replace')
+
+        return None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write('Usage: %s OUTPUT.db oui.txt [mam.txt oui36.txt iab.txt ...]\n' % sys.argv[0])
+        sys.exit(1)
+
+    records, strings = compile_database(sys.argv[1], sys.argv[2:])
+    print('Wrote %d assignments (%d distinct organizations) to %s' % (records, strings, sys.argv[1]))
@@ -0,0 +1,468 @@
+# encoding: utf-8 (as per PEP 263)
+
+# Registry of quicksearch's plain search and redirect keywords.
+#
+# Each provider has a name (as shown on the index page), one or more
+# aliases (the first path segment, e.g. "g" for /g/<query>), and a URL for
+# either or both of:
+#
+# - 'query':  /<alias>/<query> redirects here, with %s replaced by the
+#             (URL-encoded) query (so a literal % must be written as %%)
+# - 'static': /<alias> redirects here
+#
+# DEFAULT_PROVIDERS can be extended or overridden by a JSON or TOML file
+# (see providers.example.json) that is reloaded whenever it changes:
+#
+#     {"providers": [
+#         {"name": "duckduckgo", "aliases": ["ddg"], "query": "https://duckduckgo.com/?q=%s"}
+#     ]}
+#
+#     [[providers]]
+#     name = "duckduckgo"
+#     aliases = ["ddg"]
+#     query = "https://duckduckgo.com/?q=%s"
+#
+# Redirects are "303 See Other" by default, which browsers and caches don't
+# keep.  A provider's target only depends on the request URL, though, so a
+# provider may instead be redirected permanently (301 or 308) and be cached
+# for max_age seconds, and a file can set this for all providers (including
+# the built-in ones):
+#
+#     {"redirect": {"status": 308, "max_age": 86400},
+#      "providers": [
+#         {"name": "github", "aliases": ["gh"], "static": "https://github.com/",
+#          "redirect": {"status": 303}}
+#     ]}
+#
+# (Browsers keep a cached redirect even when the file changes later.)
+#
+# RedirectMiddleware answers these redirects directly at the WSGI level,
+# before a request ever reaches Flask.
+
+import http
+import json
+import os
+from urllib.parse import quote_plus
+
+from markupsafe import escape
+from werkzeug.urls import iri_to_uri
+
+import eventlog
+import reloader
+
+try:
+    import tomllib
+except ImportError:
+    # Python < 3.11: only JSON provider files are supported
+    tomllib = None
+
+TYPES = ('query', 'static')
+
+# (status code, Cache-Control max-age or None) of a provider's redirects
+DEFAULT_REDIRECT = (303, None)
+# for permanent redirects that don't specify max_age
+DEFAULT_MAX_AGE = 3600
+
+DEFAULT_PROVIDERS = [
+    {
+        'name': 'ipv6_unique_local_address_external',
+        'aliases': ['ula.ext'],
+        'static': 'http://simpledns.com/private-ipv6.aspx',
+    },
+    {
+        'name': 'google',
+        'aliases': ['google', 'g'],
+        'query': 'https://www.google.com/search?q=%s',
+    },
+    {
+        'name': 'google_image',
+        'aliases': ['i', 'gi'],
+        'query': 'https://www.google.com/search?q=%s&tbm=isch',
+    },
+    {
+        'name': 'google_video',
+        'aliases': ['v', 'gv'],
+        'query': 'https://www.google.com/search?q=%s&tbm=vid',
+    },
+    {
+        'name': 'domain_check_inwx',
+        'aliases': ['inwx'],
+        'query': 'https://www.inwx.de/de/domain/check#search=%s#region=DEFAULT#rc=rc1',
+    },
+    {
+        'name': 'domain_check_ovh',
+        'aliases': ['ovh'],
+        'query': 'https://www.ovh.de/cgi-bin/newOrder/order.cgi?domain_domainChooser_domain=%s',
+    },
+    {
+        'name': 'tineye',
+        'aliases': ['tineye'],
+        'query': 'https://tineye.com/search?url=%s',
+    },
+    {
+        'name': 'madison',
+        'aliases': ['madison'],
+        'query': 'https://qa.debian.org/madison.php?table=all&g=on&package=%s',
+    },
+    {
+        'name': 'madison_debian',
+        'aliases': ['deb'],
+        'query': 'https://qa.debian.org/madison.php?table=debian&g=on&package=%s',
+    },
+    {
+        'name': 'madison_ubuntu',
+        'aliases': ['ubu'],
+        'query': 'https://qa.debian.org/madison.php?table=ubuntu&g=on&package=%s',
+    },
+    {
+        'name': 'packages_debian',
+        'aliases': ['dpkg'],
+        'query': 'https://packages.debian.org/search?keywords=%s',
+    },
+    {
+        'name': 'packages_ubuntu',
+        'aliases': ['upkg'],
+        'query': 'http://packages.ubuntu.com/search?keywords=%s',
+    },
+    {
+        'name': 'packages_archlinux',
+        'aliases': ['apkg'],
+        'query': 'https://www.archlinux.org/packages/?q=%s',
+    },
+    {
+        'name': 'packages_archuserrepo',
+        'aliases': ['aur'],
+        'query': 'https://aur.archlinux.org/packages/?K=%s',
+    },
+    {
+        'name': 'packages_repology_stats',
+        'aliases': ['repo'],
+        'static': 'https://repology.org/repositories/statistics',
+    },
+    {
+        'name': 'packages_repology_search',
+        'aliases': ['repo'],
+        'query': 'https://repology.org/projects/?search=%s',
+    },
+    {
+        'name': 'packages_freebsd_freshports',
+        'aliases': ['fport', 'fports', 'freshports'],
+        'query': 'https://www.freshports.org/search.php?num=20&query=%s',
+    },
+    {
+        'name': 'packages_gentoo',
+        'aliases': ['gpkg', 'eix'],
+        'query': 'https://packages.gentoo.org/packages/search?q=%s',
+    },
+    {
+        'name': 'mensa_uni_passau',
+        'aliases': ['mensa'],
+        'static': 'http://www.stwno.de/infomax/daten-extern/html/speiseplaene.php?einrichtung=UNI-P',
+    },
+    {
+        'name': 'string_manipulation_bash',
+        'aliases': ['strings.bash', 'bash-strings'],
+        'static': 'http://tldp.org/LDP/abs/html/string-manipulation.html',
+    },
+    {
+        'name': 'string_manipulation_posix',
+        'aliases': ['strings.sh'],
+        'static': 'https://pubs.opengroup.org/onlinepubs/9699919799.2008edition/utilities/V3_chap02.html#tag_18_06_02',
+    },
+    {
+        'name': 'denic_web_whois',
+        'aliases': ['denic'],
+        'query': 'https://www.denic.de/webwhois-web20/?domain=%s',
+    },
+    {
+        'name': 'ssllabs',
+        'aliases': ['ssll'],
+        'query': 'https://www.ssllabs.com/ssltest/analyze.html?d=%s&hideResults=on&latest',
+    },
+    {
+        'name': 'hurricane_electric_bgp',
+        'aliases': ['bgp'],
+        'query': 'http://bgp.he.net/search?commit=Search&search[search]=%s',
+    },
+    {
+        'name': 'tldlist_tld_info',
+        'aliases': ['tld'],
+        'query': 'https://tld-list.com/tld/%s',
+    },
+    {
+        'name': 'wolfram_alpha',
+        'aliases': ['woa'],
+        'query': 'https://www.wolframalpha.com/input/?i=%s',
+    },
+    {
+        'name': 'dict_cc',
+        'aliases': ['dcc'],
+        'query': 'https://www.dict.cc/?s=%s',
+    },
+    {
+        'name': 'giphy',
+        'aliases': ['gif'],
+        'query': 'http://giphy.com/search/%s',
+    },
+    {
+        'name': 'facepalm',
+        'aliases': ['fp'],
+        'static': 'http://i3.kym-cdn.com/photos/images/original/000/001/582/picard-facepalm.jpg',
+    },
+    {
+        'name': 'randname',
+        'aliases': ['randname'],
+        'static': 'http://www.behindthename.com/random/random.php?number=1&gender=u&surname=&nodiminutives=yes&all=yes',
+    },
+    {
+        'name': 'uk_company_registrations',
+        'aliases': ['ukcomp'],
+        'query': 'https://beta.companieshouse.gov.uk/search?q=%s',
+    },
+    {
+        'name': 'unicode_character_inspector',
+        'aliases': ['uci', 'unicode'],
+        'query': 'https://apps.timwhitlock.info/unicode/inspect?s=%s',
+    },
+    {
+        'name': 'unicode_character_search',
+        'aliases': ['ucs', 'sunicode'],
+        'query': 'http://www.fileformat.info/info/unicode/char/search.htm?q=%s&preview=entity',
+    },
+    {
+        'name': 'wikipedia_en',
+        'aliases': ['wiki', 'enwiki'],
+        'query': 'https://en.wikipedia.org/w/index.php?search=%s',
+    },
+    {
+        'name': 'wikipedia_de',
+        'aliases': ['dewiki'],
+        'query': 'https://de.wikipedia.org/w/index.php?search=%s',
+    },
+    {
+        'name': 'rfc_text_search',
+        'aliases': ['rfc'],
+        'query': 'https://tools.ietf.org/googleresults?q=%s',
+    },
+    {
+        'name': 'intel_ark',
+        'aliases': ['ark'],
+        'query': 'https://ark.intel.com/content/www/us/en/ark/search.html?q=%s',
+    },
+    {
+        'name': 'posix_2008',
+        'aliases': ['posix', 'posix2008'],
+        'static': 'https://pubs.opengroup.org/onlinepubs/9699919799.2008edition/',
+    },
+    {
+        'name': 'ansible_module',
+        'aliases': ['ansible'],
+        'query': 'https://docs.ansible.com/ansible/latest/modules/%s_module.html',
+    },
+]
+
+
+def load_providers_file(path):
+    # returns: (list of provider dicts, redirect settings for all providers
+    #          or None) from a JSON or TOML file
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise ValueError('TOML provider files need Python >= 3.11')
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    return (data.get('providers', []), data.get('redirect'))
+
+
+def redirect_mode(settings, default=DEFAULT_REDIRECT):
+    # settings: {'status': ..., 'max_age': ...} from a provider (file), or None
+    # returns: (status code, Cache-Control max-age or None)
+    if not settings:
+        return default
+
+    status = int(settings.get('status', default[0]))
+    if status == 303:
+        return (303, None)
+    if status not in (301, 308):
+        raise ValueError('unsupported redirect status %d (use 301, 303 or 308)' % status)
+    return (status, int(settings.get('max_age', default[1] or DEFAULT_MAX_AGE)))
+
+
+def check_provider(provider):
+    # raises ValueError if a provider definition couldn't be served (so that
+    # a broken file is rejected as a whole, rather than failing requests)
+    if not isinstance(provider, dict):
+        raise ValueError('provider must be a table/object: %r' % (provider,))
+    if not isinstance(provider.get('name'), str):
+        raise ValueError('provider without a name: %r' % (provider,))
+    aliases = provider.get('aliases')
+    if not isinstance(aliases, list) or not aliases or not all(isinstance(alias, str) and alias for alias in aliases):
+        raise ValueError('%s: aliases must be a list of strings' % provider['name'])
+    if not any(kind in provider for kind in TYPES):
+        raise ValueError('%s: neither query nor static URL given' % provider['name'])
+    for kind in TYPES:
+        if kind in provider and not isinstance(provider[kind], str):
+            raise ValueError('%s: %s URL must be a string' % (provider['name'], kind))
+    if 'query' in provider:
+        try:
+            provider['query'] % 'x'
+        except (TypeError, ValueError) as e:
+            raise ValueError('%s: query URL needs exactly one %%s (write a literal %% as %%%%): %s' % (provider['name'], e))
+
+
+def build_table(providers, default_redirect=DEFAULT_REDIRECT):
+    # returns: dict mapping each alias to {'query': (name, URL, redirect mode),
+    #          'static': (name, URL, redirect mode)} (with only the types that
+    #          are defined for it; redirect mode as per redirect_mode())
+    table = dict()
+    for provider in providers:
+        check_provider(provider)
+        mode = redirect_mode(provider.get('redirect'), default_redirect)
+        for alias in provider['aliases']:
+            entry = table.setdefault(alias, dict())
+            for kind in TYPES:
+                if kind in provider:
+                    entry[kind] = (provider['name'], provider[kind], mode)
+    return table
+
+
+class ProviderRegistry:
+    def __init__(self, path=None, defaults=DEFAULT_PROVIDERS):
+        self.path = path
+        self.defaults = defaults
+        # alias table, rebuilt whenever the providers file's mtime changes
+        self._reloader = reloader.Reloader(self._mtime, self._build)
+
+    def _mtime(self):
+        # returns: the providers file's mtime, or None if there is none
+        if self.path:
+            try:
+                return os.stat(self.path).st_mtime_ns
+            except OSError:
+                pass
+        return None
+
+    def _build(self, previous):
+        try:
+            providers = list(self.defaults)
+            default_redirect = DEFAULT_REDIRECT
+            if self.path and os.path.exists(self.path):
+                extra, settings = load_providers_file(self.path)
+                providers += extra
+                default_redirect = redirect_mode(settings)
+            return build_table(providers, default_redirect)
+        except Exception as e:
+            eventlog.log('providers_error', path=self.path, error=str(e) or repr(e))
+            # keep serving the previous table, or at least the defaults
+            return previous or build_table(self.defaults)
+
+    def reload(self):
+        return self._reloader.get()
+
+    def lookup(self, alias):
+        # returns: {'query': (name, URL, redirect mode), 'static': (name, URL,
+        #          redirect mode)} (either may be missing), or None if the
+        #          alias isn't defined
+        return self.reload().get(alias)
+
+    def entries(self):
+        # yields: (alias, type, name, URL) for all defined redirects
+        for alias, entry in self.reload().items():
+            for kind, (name, url, mode) in entry.items():
+                yield (alias, kind, name, url)
+
+
+def redirect_response(location, mode=DEFAULT_REDIRECT):
+    # returns: (status line, headers, body) of a redirect, just like Flask's
+    #          redirect() (see quicksearch.static_redirect_handler())
+    status, max_age = mode
+    html_location = escape(location)
+    body = (
+        '<!doctype html>\n'
+        '<html lang=en>\n'
+        '<title>Redirecting...</title>\n'
+        '<h1>Redirecting...</h1>\n'
+        '<p>You should be redirected automatically to the target URL: '
+        '<a href="%s">%s</a>. If not, click the link.\n' % (html_location, html_location)
+        ).encode('utf-8')
+    headers = [
+        ('Content-Type', 'text/html; charset=utf-8'),
+        ('Content-Length', str(len(body))),
+        # (encoded like Werkzeug does for Flask's responses, so the header
+        # is plain ASCII)
+        ('Location', iri_to_uri(location)),
+    ]
+    if max_age is not None:
+        headers.append(('Cache-Control', 'public, max-age=%d' % max_age))
+    return ('%d %s' % (status, http.HTTPStatus(status).phrase.upper()), headers, body)
+
+
+class RedirectMiddleware:
+    # Answers GET/HEAD requests for the registry's keywords without going
+    # through Flask (request context, URL map matching, response objects).
+    # Keywords that also appear as the first path segment of a regular Flask
+    # route (e.g. /rfc/<int:query>) are always left to Flask, as are any
+    # paths that Flask/Werkzeug would normalize first.
+
+    def __init__(self, app, registry, url_map):
+        self.app = app
+        self.registry = registry
+        self.url_map = url_map
+        # (alias table, keywords reserved by Flask routes,
+        #  alias -> precomputed (status, headers, body) for static redirects)
+        self._state = (None, None, None)
+
+    def _prepare(self):
+        table = self.registry.reload()
+        state = self._state
+        if state[0] is table:
+            return state
+
+        reserved = set()
+        for rule in self.url_map.iter_rules():
+            if rule.endpoint == 'provider_redirect':
+                continue
+            first = rule.rule.lstrip('/').split('/')[0]
+            if '<' not in first:
+                reserved.add(first)
+
+        static = dict()
+        for alias, entry in table.items():
+            if 'static' in entry and alias not in reserved:
+                name, url, mode = entry['static']
+                static[alias] = redirect_response(url, mode)
+
+        self._state = (table, reserved, static)
+        return self._state
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD')
+        if method == 'GET' or method == 'HEAD':
+            table, reserved, static = self._prepare()
+
+            # PATH_INFO is a latin-1 decoded byte string, as per PEP 3333
+            path = environ.get('PATH_INFO', '')
+            keyword, slash, query = path[1:].partition('/')
+
+            if keyword not in reserved and '//' not in path and not path.endswith('/'):
+                response = None
+                if not slash:
+                    response = static.get(keyword)
+                else:
+                    entry = table.get(keyword)
+                    if entry is not None and 'query' in entry:
+                        query = query.encode('latin-1').decode('utf-8', 'replace')
+                        query_string = environ.get('QUERY_STRING', '')
+                        if query_string:
+                            query += '?' + query_string.encode('latin-1').decode('utf-8', 'replace')
+                        name, url, mode = entry['query']
+                        response = redirect_response(url % quote_plus(query), mode)
+
+                if response is not None:
+                    status, headers, body = response
+                    start_response(status, list(headers))
+                    return [body] if method == 'GET' else []
+
+        return self.app(environ, start_response)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # encoding: utf-8 (as per PEP 263)
 
-from flask import Flask, Response, abort, redirect, request, send_file, url_for
+from flask import Flask, Response, abort, redirect, request, url_for
 try:
     # Werkzeug >= 0.15.0
     from werkzeug.middleware.proxy_fix import ProxyFix
@@ -9,31 +9,71 @@ except:
     # Werkzeug < 0.15.0
     from werkzeug.contrib.fixers import ProxyFix
 from urllib.parse import quote, quote_plus, unquote, unquote_plus
+from xml.sax.saxutils import escape as xml_escape, quoteattr as xml_quoteattr
 import os
-import glob
 import re
 import ipaddress
-try:
-    import telnum
-except:
-    import sys
-    sys.stderr.write('Could not import telnum module. Telnum functionality will be disabled.\n')
-try:
-    import ula
-except:
-    import sys
-    sys.stderr.write('Could not import ula module. ULA functionality will be disabled.\n')
-try:
-    from dns import resolver
-except:
-    import sys
-    sys.stderr.write('Could not import dnspython module. IP info functionality will be disabled.\n')
+import functools
+import hashlib
+import json
+import eventlog
+import gitignores
+import lazy
+import metrics
+import ouidb
+import providers
+import urlclean
 
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app)
 
-@app.route('/')
-def root():
+# see quicksearch.example.conf
+eventlog.configure(
+        maxsize=int(os.environ.get('QUICKSEARCH_LOG_QUEUE_SIZE', 10000)),
+        sample_rates=eventlog.parse_sample_rates(os.environ.get('QUICKSEARCH_LOG_SAMPLE', '')),
+        )
+
+PROVIDERS_PATH = os.environ.get('QUICKSEARCH_PROVIDERS',
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'providers.json'))
+
+provider_registry = providers.ProviderRegistry(PROVIDERS_PATH)
+
+# answer plain keyword redirects before they even reach Flask
+app.wsgi_app = providers.RedirectMiddleware(app.wsgi_app, provider_registry, app.url_map)
+
+# no log records under a previous request's endpoint (see eventlog.py)
+app.wsgi_app = eventlog.EndpointMiddleware(app.wsgi_app)
+
+# count and time all requests, including those answered by the
+# RedirectMiddleware (which never get to note_endpoint() below)
+app.wsgi_app = metrics.MetricsMiddleware(app.wsgi_app, 'provider_redirect')
+
+@app.before_request
+def note_endpoint():
+    request.environ[metrics.ENDPOINT_KEY] = request.endpoint or 'unmatched'
+    eventlog.endpoint.set(request.endpoint or 'unmatched')
+
+# url_root -> (provider table, hidden endpoints, index); see root_index()
+root_index_cache = dict()
+
+# endpoint -> LazyResource it depends on; the index leaves out endpoints whose
+# resource is known to be unavailable (see LazyResource.available())
+endpoint_resources = dict()
+
+def root_index(url_root):
+    # returns: dict with the index page as plain text and JSON (each as
+    #          (body, ETag)), and the OpenSearch URL template per keyword
+    #
+    # The URL map never changes after import and the provider table only on
+    # reload, so this is only computed once per url_root (and table, and set
+    # of unavailable features).
+    table = provider_registry.reload()
+    hidden = frozenset(endpoint for endpoint, resource in endpoint_resources.items()
+            if not resource.available())
+    cached = root_index_cache.get(url_root)
+    if cached is not None and cached[0] is table and cached[1] == hidden:
+        return cached[2]
+
     searches = []
     redirects = []
     header = []
@@ -49,19 +89,47 @@ def root():
     r_header += ['The following static redirections are defined:']
     r_header += ['']
 
-    for rule in app.url_map.iter_rules():
-        if rule.endpoint in ['static', 'root']:
-            continue
+    entries = []
+    templates = dict()
 
-        url = request.url_root.rstrip('/') + re.sub(r'<(.+:)?(.+)>', r'…', str(rule))
-        url = url.rpartition('://')[2]
-        line = unquote("* {:40s} {}".format(rule.endpoint, url))
+    def add_entry(name, keyword, path, template):
+        url = url_root.rstrip('/') + path
+        line = unquote("* {:40s} {}".format(name, url.rpartition('://')[2]))
 
         if '…' in url:
             searches.append(line)
         else:
             redirects.append(line)
 
+        if template:
+            templates.setdefault(keyword, (name, template))
+        entries.append({
+            'name': name,
+            'url': unquote(url),
+            'type': 'search' if '…' in url else 'redirect',
+            'template': template,
+        })
+
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint in ['static', 'root', 'provider_redirect', 'opensearch_description', 'prometheus_metrics']:
+            continue
+        if 'GET' not in rule.methods:
+            # batch endpoints can't be used from the address bar anyway
+            continue
+        if rule.endpoint in hidden:
+            continue
+
+        template = None
+        if len(rule.arguments) == 1:
+            template = url_root.rstrip('/') + re.sub(r'<(.+:)?(.+)>', r'{searchTerms}', str(rule))
+        add_entry(rule.endpoint, str(rule).split('/')[1], re.sub(r'<(.+:)?(.+)>', r'…', str(rule)), template)
+
+    for alias, kind, name, target in provider_registry.entries():
+        if kind == 'query':
+            add_entry(name, alias, '/' + alias + '/…', url_root.rstrip('/') + '/' + alias + '/{searchTerms}')
+        else:
+            add_entry(name, alias, '/' + alias, None)
+
     response_lines = header
     if searches:
         response_lines += s_header
@@ -70,20 +138,86 @@ def root():
         response_lines += r_header
         response_lines += sorted(redirects)
 
+    text = '\n'.join(response_lines)+'\n'
+    entries.sort(key=lambda entry: (entry['type'], entry['name'], entry['url']))
+    entries_json = json.dumps(entries, ensure_ascii=False, indent=1) + '\n'
+
+    index = {
+        'text': (text, hashlib.sha1(text.encode('utf-8')).hexdigest()),
+        'json': (entries_json, hashlib.sha1(entries_json.encode('utf-8')).hexdigest()),
+        'templates': templates,
+    }
+
+    if len(root_index_cache) >= 16:
+        # url_root comes from the Host header, so don't let it grow unbounded
+        root_index_cache.clear()
+    root_index_cache[url_root] = (table, hidden, index)
+    return index
+
+@app.route('/')
+def root():
+    index = root_index(request.url_root)
+
+    if 'json' in request.args or \
+            request.accept_mimetypes.best_match(['text/plain', 'application/json']) == 'application/json':
+        body, etag = index['json']
+        response = Response(body, mimetype='application/json')
+    else:
+        body, etag = index['text']
+        response = Response(body, mimetype='text/plain')
+
+    # (?json aside) the format depends on the Accept header, so shared
+    # caches must not serve one to clients asking for the other
+    response.vary.add('Accept')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/metrics')
+def prometheus_metrics():
     return Response(
-            '\n'.join(response_lines)+'\n',
-            mimetype='text/plain'
+            metrics.registry.render(),
+            mimetype='text/plain; version=0.0.4'
+            )
+
+@app.route('/opensearch/<string:keyword>.xml')
+def opensearch_description(keyword):
+    # lets browsers add any search keyword as a search engine
+    template = root_index(request.url_root)['templates'].get(keyword)
+    if template is None:
+        abort(404)
+
+    name, template = template
+    return Response(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<OpenSearchDescription xmlns="http://a9.com/-/spec/opensearch/1.1/">\n'
+            '  <ShortName>%s</ShortName>\n'
+            '  <Description>%s (QuickSearch /%s/)</Description>\n'
+            '  <InputEncoding>UTF-8</InputEncoding>\n'
+            '  <Url type="text/html" template=%s/>\n'
+            '</OpenSearchDescription>\n' % (
+                xml_escape(keyword[:16]),
+                xml_escape(name),
+                xml_escape(keyword),
+                xml_quoteattr(template),
+                ),
+            mimetype='application/opensearchdescription+xml'
             )
 
-def simple_query_handler(url, query):
+def simple_query_handler(url, query, mode=providers.DEFAULT_REDIRECT):
     search_str = query
     if request.query_string:
         search_str += '?' + request.query_string.decode('utf-8')
 
-    return redirect(url % quote_plus(search_str), code=303)
+    return static_redirect_handler(url % quote_plus(search_str), mode)
 
-def static_redirect_handler(url):
-    return redirect(url, code=303)
+def static_redirect_handler(url, mode=providers.DEFAULT_REDIRECT):
+    # mode: (status code, Cache-Control max-age or None), see providers.py
+    status, max_age = mode
+    response = redirect(url, code=status)
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
 
 def print_client_ip_handler():
     addr = ipaddress.ip_address(request.remote_addr)
@@ -97,217 +231,85 @@ def print_client_ip_handler():
             )
 
 try:
-    import requests
-    import json
-    from datetime import datetime, timedelta
-    from zoneinfo import ZoneInfo
+    import ttlcache
+    import bahnexpert
+
+    def load_bahnexpert_client():
+        # see quicksearch.example.conf
+        return bahnexpert.BahnExpertClient(
+                connect_timeout=float(os.environ.get('QUICKSEARCH_ZUG_CONNECT_TIMEOUT', 3.05)),
+                read_timeout=float(os.environ.get('QUICKSEARCH_ZUG_READ_TIMEOUT', 10)),
+                # Results are cached per (train number, date)
+                cache=ttlcache.TTLCache(
+                    maxsize=int(os.environ.get('QUICKSEARCH_ZUG_CACHE_SIZE', 1024)),
+                    ttl=float(os.environ.get('QUICKSEARCH_ZUG_CACHE_TTL', 300)),
+                    stale_ttl=float(os.environ.get('QUICKSEARCH_ZUG_CACHE_STALE', 600)),
+                    ),
+                )
+
+    # (requests is only imported when the first train search comes in)
+    bahnexpert_client = lazy.LazyResource(load_bahnexpert_client,
+            'Could not import requests module. Train search functionality will be disabled.',
+            probe=lazy.modules_exist('requests'))
+    endpoint_resources.update(dict.fromkeys([
+            'bahn_expert_train_number',
+            'bahn_expert_train_date_number',
+            'bahn_expert_train_country_date_number',
+            ], bahnexpert_client))
+
+    # responses shared with the async handlers in quicksearch_asgi.py
+
+    def invalid_days_response():
+        return Response(
+                'Error\nInvalid input (days must be e.g. -1..+1 or -1,+1, at most %d days)\n' % bahnexpert.MAX_SEARCHDATES,
+                mimetype='text/plain'
+                ), 400
+
+    def train_search_response(results, verbose_mode):
+        if not results:
+            return Response('No trains were found matching these search parameters.',
+                        mimetype='text/plain'
+                    )
+        elif len(results) > 1 or verbose_mode:
+            return Response('The following train journeys match your query:<br/>\n<ul>\n'+
+                            ''.join(['<li><a href="%s">%s</a></li>\n' % (x[1], x[0]) for x in results])+
+                            '</ul>',
+                        mimetype='text/html'
+                    )
+        else:
+            return redirect(results[0][1], code=303)
+
+    def train_search_error_response(e):
+        eventlog.log('train_search_error', error=str(e) or repr(e))
+        return Response('An error occurred while searching for this train.\nDetails are not revealed to the user, sorry.\n',
+                mimetype='text/plain'
+                )
 
     @app.route('/zug/<int:zugnr>')
     def bahn_expert_train_number(zugnr, searchdate=None, country='DE'):
         # tldr: find the bahn.expert link(s)
         # to the one (or multiple) train running
         # - as the given number &&
-        # - on the given day (default: today) &&
-        # - beginning and/or ending in the given country (default: Germany)
+        # - on the given day(s) (default: today) &&
+        # - beginning and/or ending in the given country/countries (default: Germany)
         # if only one result: redirect there immediately.
+        client = bahnexpert_client.get()
+        if client is None:
+            abort(404)
 
-        UIC_COUNTRY_CODES = {
-                'FI': 10,
-                'RU': 20,
-                'BY': 21,
-                'UA': 22,
-                'MD': 23,
-                'LT': 24,
-                'LV': 25,
-                'EE': 26,
-                'KZ': 27,
-                'GE': 28,
-                'UZ': 29,
-                'KP': 30,
-                'MN': 31,
-                'VN': 32,
-                'CN': 33,
-                'LA': 34,
-                'CU': 40,
-                'AL': 41,
-                'JP': 42,
-                'BA': 44,
-                'BA': 49,
-                'BA': 50,
-                'PL': 51,
-                'BG': 52,
-                'RO': 53,
-                'CZ': 54,
-                'HU': 55,
-                'SK': 56,
-                'AZ': 57,
-                'AM': 58,
-                'KG': 59,
-                'IE': 60,
-                'KR': 61,
-                'ME': 62,
-                'MK': 65,
-                'TJ': 66,
-                'TM': 67,
-                'AF': 68,
-                'GB': 70,
-                'ES': 71,
-                'RS': 72,
-                'GR': 73,
-                'SE': 74,
-                'TR': 75,
-                'NO': 76,
-                'HR': 78,
-                'SI': 79,
-                'DE': 80,
-                'AT': 81,
-                'LU': 82,
-                'IT': 83,
-                'NL': 84,
-                'CH': 85,
-                'DK': 86,
-                'FR': 87,
-                'BE': 88,
-                'TZ': 89,
-                'EG': 90,
-                'TN': 91,
-                'DZ': 92,
-                'MA': 93,
-                'PT': 94,
-                'IL': 95,
-                'IR': 96,
-                'SY': 97,
-                'LB': 98,
-                'IQ': 99,
-        }
-        def get_country_code(country):
-            country = country.upper()
-            if country in UIC_COUNTRY_CODES:
-                country = str(UIC_COUNTRY_CODES[country])
-            return country
-
-        def query_bahnexpert(journeyNumber, searchdate=None):
-            if not searchdate:
-                searchdate = datetime.now(ZoneInfo("Europe/Berlin")).date().isoformat()
-            elif searchdate.startswith('-') or searchdate.startswith('+'):
-                delta = timedelta(days=int(searchdate))
-                searchdate = (datetime.now(ZoneInfo("Europe/Berlin")).date() + delta).isoformat()
-            input_json = json.dumps({
-                "0": json.dumps([
-                        {'journeyNumber': 1, 'initialDepartureDate': 2, 'withOEV': 3},
-                        journeyNumber, ['Date', searchdate], False
-                ])
-            })
-            params = {
-                'batch': 1,
-                'input': input_json,
-            }
-            headers = {
-                'referer': 'https://bahn.expert/',
-            }
-            url = 'https://bahn.expert/rpc/journeys.find'
-            response = requests.get(url, params=params, headers=headers)
-            if response.status_code == 404:
-                url = 'https://bahn.expert/rpc/journey.find'
-                response = requests.get(url, params=params, headers=headers)
-            return json.loads(response.json()[0]['result']['data'])
-
-        def unravel(j, index=0):
-            # "decompress" the weird key-value-indirection JSON from bahn.expert
-            if index < 0:
-                return None
-
-            if type(j[index]) == list:
-                output = []
-                for item in j[index]:
-                    output.append(unravel(j, item))
-                return output
-
-            elif type(j[index]) == dict:
-                output = dict()
-                for key, value in j[index].items():
-                    output[key] = unravel(j, value)
-                return output
-
-            elif type(j[index]) in [str, int, float]:
-                return j[index]
-
-        def find_country_and_train_journey(journeys, country_code):
-            # returns: list of tuples (human-readable name, URL)
-            results = []
-            for journey in journeys:
-                if not journey['firstStop']['stopPlace']['evaNumber'].startswith(country_code) \
-                   and not journey['lastStop']['stopPlace']['evaNumber'].startswith(country_code):
-                    continue
-
-                train = journey['train']
-
-                if 'Bus' in train.get('category', []):
-                    continue
-
-                if train.get('name', None):
-                    name = train.get('name')
-                else:
-                    parts = []
-
-                    if train.get('category', None):
-                        # add a category if there is one, and it isn't repeated in the line anyway (e.g. "RB RB27")
-                        if not train.get('line', None):
-                            parts.append(train.get('category'))
-                        elif train.get('line', '').startswith(train.get('category')):
-                            pass
-                        else:
-                            parts.append(train.get('category'))
-
-                    if train.get('line', None):
-                        parts.append(train.get('line'))
-                    else:
-                        parts.append(str(train.get('journeyNumber')))
-
-                    name = ' '.join(parts)
-
-                results.append(
-                        (
-                        '%s (%s)' % (
-                            name,
-                            train.get('journeyNumber')
-                            ),
-                        'https://bahn.expert/details/%s %s/j/%s' % (
-                            train.get('category'),
-                            train.get('journeyNumber'),
-                            journey['journeyId']
-                            )
-                        )
-                    )
-            return results
-
+        # several days (?days=-1..+1) and/or countries (DE,AT) can be searched at once
         try:
-            bahnexpert_json = query_bahnexpert(zugnr, searchdate)
-            journeys = unravel(bahnexpert_json)
-            country_code = get_country_code(country)
-            results = find_country_and_train_journey(journeys, country_code)
-
-            verbose_mode = 'v' in request.args
-
-            if not results:
-                return Response('No trains were found matching these search parameters.',
-                            mimetype='text/plain'
-                        )
-            elif len(results) > 1 or verbose_mode:
-                return Response('The following train journeys match your query:<br/>\n<ul>\n'+
-                                ''.join(['<li><a href="%s">%s</a></li>\n' % (x[1], x[0]) for x in results])+
-                                '</ul>',
-                            mimetype='text/html'
-                        )
-            else:
-                return redirect(results[0][1], code=303)
+            searchdates = bahnexpert.expand_searchdates(searchdate, request.args.get('days'))
+        except ValueError:
+            return invalid_days_response()
+        countries = [c for c in country.split(',') if c]
 
+        try:
+            results = client.find_trains(zugnr, searchdates, countries)
         except Exception as e:
-            import sys
-            sys.stderr.write(str(e))
-            return Response('An error occurred while searching for this train.\nDetails are not revealed to the user, sorry.\n',
-                    mimetype='text/plain'
-                    )
+            return train_search_error_response(e)
+
+        return train_search_response(results, 'v' in request.args)
 
     @app.route('/zug/<string:searchdate>/<int:zugnr>')
     def bahn_expert_train_date_number(zugnr, searchdate):
@@ -325,215 +327,348 @@ except:
 def whats_my_ip():
     return print_client_ip_handler()
 
-try:
-    from dns import resolver
-
-    # approximate compatibility (different search list behaviour) with dnspython < v2.0.0
-    if not hasattr(resolver, 'resolve'):
-        resolver.resolve = resolver.query
+ASN_PREFIX_PATHS = [
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'pfx2as.txt'),
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'pfx2as6.txt'),
+        ]
+ASN_NAMES_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'asn.txt')
+
+def load_ipinfo_resolver():
+    import ipinfo
+
+    if any(os.path.isfile(path) for path in ASN_PREFIX_PATHS + [ASN_NAMES_PATH]):
+        import asndb
+        asn_db = asndb.ASNDatabase(ASN_PREFIX_PATHS, ASN_NAMES_PATH)
+        # (starts loading the tables in the background; lookups use Cymru's
+        # DNS service until they are ready)
+        asn_db.reload()
+    else:
+        asn_db = None
+
+    # see quicksearch.example.conf
+    return ipinfo.IPInfoResolver(
+            asn_db=asn_db,
+            deadline=float(os.environ.get('QUICKSEARCH_IPI_DEADLINE', 5)),
+            cache_size=int(os.environ.get('QUICKSEARCH_DNS_CACHE_SIZE', 4096)),
+            min_ttl=float(os.environ.get('QUICKSEARCH_DNS_MIN_TTL', 30)),
+            max_ttl=float(os.environ.get('QUICKSEARCH_DNS_MAX_TTL', 86400)),
+            negative_ttl=float(os.environ.get('QUICKSEARCH_DNS_NEGATIVE_TTL', 60)),
+            )
 
-    def print_client_ip_info_handler(addr):
-        if type(addr) == ipaddress.IPv6Address and addr.ipv4_mapped:
-            addr = addr.ipv4_mapped
+# (dnspython and the ASN tables are only loaded for the first IP info lookup)
+ipinfo_resolver = lazy.LazyResource(load_ipinfo_resolver,
+        'Could not import dnspython module. IP info functionality will be disabled.',
+        probe=lazy.modules_exist('dns'))
+endpoint_resources.update(dict.fromkeys(['whats_my_ip_info', 'ip_info'], ipinfo_resolver))
+# number of addresses looked up at the same time by a batch request
+ipinfo_batch_window = int(os.environ.get('QUICKSEARCH_IPI_BATCH_WINDOW', 32))
 
-        cymru_query = addr.reverse_pointer \
-            .replace('.ip6.arpa', '.origin6.asn.cymru.com') \
-            .replace('.in-addr.arpa', '.origin.asn.cymru.com')
+# responses shared with the async handlers in quicksearch_asgi.py
 
-        result = []
+def ip_info_response(lines):
+    return Response(
+            '\n'.join(lines) + '\n',
+            mimetype='text/plain'
+            )
 
-        if addr.version == 4:
-            addr_version = 'IPv4'
-        elif addr.version == 6:
-            addr_version = 'IPv6'
-        else:
-            addr_version = 'Address version unknown'
+def ip_info_line(lines):
+    # returns: the output lines of one /ipi lookup joined into a single line
+    #          (same fields, same order) for the batch endpoint
+    return ' | '.join(lines)
 
-        try:
-            ptrs = '+'.join([
-                record.to_text() for record in
-                    resolver.resolve(addr.reverse_pointer, 'PTR')
-                ])
-        except Exception as e:
-            import sys
-            sys.stderr.write(str(e))
-            ptrs = 'no PTR'
+def invalid_address_response(e):
+    eventlog.log('invalid_address', error=str(e))
+    return Response(
+            'Error\nInvalid input (not an IP address)\n',
+            mimetype='text/plain'
+            ), 400
+
+def batch_lines(text):
+    # returns: list of the queries (non-empty lines) in e.g. a POST body
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def batch_response(results, json_mode=False):
+    # results: iterable of one output line (without newline) per query, or
+    #          with json_mode, of one JSON object (as dict) per query
+    # returns: response streaming the results as they are produced, as plain
+    #          text or JSON lines
+    if json_mode:
+        lines = (json.dumps(result) + '\n' for result in results)
+    else:
+        lines = (result + '\n' for result in results)
 
-        result.append('%s | %s | %s' % (
-            addr_version,
-            str(addr),
-            ptrs))
+    return Response(
+            lines,
+            mimetype='application/x-ndjson' if json_mode else 'text/plain'
+            )
 
-        try:
-            answer = resolver.resolve(cymru_query, 'TXT')
-        except Exception as e:
-            import sys
-            sys.stderr.write(str(e))
-            answer = ['No information available']
-
-        for record in answer:
-            text = str(record).strip('"')
-            result.append(text)
-            asns = text.split('|')[0].split()
-
-            for asn in asns:
-                try:
-                    asn = int(asn)
-                except:
-                    # skip non-numerical data (it's probably an error message)
-                    continue
-
-                try:
-                    answer2 = resolver.resolve('AS%d.asn.cymru.com' % asn, 'TXT')
-                except Exception as e:
-                    import sys
-                    sys.stderr.write(str(e))
-                    answer2 = ['No information available']
-                for record2 in answer2:
-                    text2 = str(record2).strip('"')
-                    result.append(text2)
+def available_ipinfo_resolver():
+    resolver = ipinfo_resolver.get()
+    if resolver is None:
+        abort(404)
+    return resolver
+
+def print_client_ip_info_handler(addr):
+    return ip_info_response(available_ipinfo_resolver().describe(addr))
+
+@app.route('/ipi', methods=['POST'])
+def ip_info_batch():
+    # one output line per (non-empty) input line, streamed as we go
+    resolver = available_ipinfo_resolver()
+    addrs = batch_lines(request.get_data(as_text=True))
+    return batch_response(ip_info_line(lines) for lines in resolver.describe_many(addrs, ipinfo_batch_window))
+
+@app.route('/ipi')
+def whats_my_ip_info():
+    return print_client_ip_info_handler(ipaddress.ip_address(request.remote_addr))
+
+@app.route('/ipi/<string:addr>')
+def ip_info(addr):
+    try:
+        addr = ipaddress.ip_address(addr)
+    except Exception as e:
+        return invalid_address_response(e)
+    return print_client_ip_info_handler(addr)
+
+def load_telnum():
+    # telnum pulls in phonenumbers and all of its metadata
+    import telnum
+    return telnum
+
+telnum_module = lazy.LazyResource(load_telnum,
+        'Could not import telnum module. Telnum functionality will be disabled.',
+        probe=lazy.modules_exist('telnum', 'phonenumbers'))
+endpoint_resources.update(dict.fromkeys(['phone_number_info', 'phone_number_plan_wikipedia'], telnum_module))
+
+def telnum_key(num):
+    # returns: the number without the separators people tend to write into
+    #          it (which phonenumbers ignores anyway), e.g. +49 30/1234-56
+    #          -> +4930123456
+    return re.sub(r'[\s./-]+', '', num)
+
+# Parsing, geocoding and the carrier lookup take a while and their result
+# only depends on the number (and the phonenumbers metadata), so it's kept
+# for the most recently asked numbers
+@functools.lru_cache(maxsize=int(os.environ.get('QUICKSEARCH_TELNUM_CACHE_SIZE', 4096)))
+def telnum_text(key):
+    return telnum_module.get().number_to_text(key)
+
+@app.route('/telnum/<path:num>')
+def phone_number_info(num, wikipedia=False):
+    if telnum_module.get() is None:
+        abort(404)
+
+    result = telnum_text(telnum_key(num))
+    parts = result.split()
+    if wikipedia and parts[-1] != 'invalid':
+        country_code = parts[0]
+        return static_redirect_handler('https://en.wikipedia.org/wiki/' + quote(country_code))
 
+    else:
         return Response(
-                '\n'.join(result) + '\n',
+                result + '\n',
                 mimetype='text/plain'
                 )
 
-    @app.route('/ipi')
-    def whats_my_ip_info():
-        return print_client_ip_info_handler(ipaddress.ip_address(request.remote_addr))
-
-    @app.route('/ipi/<string:addr>')
-    def ip_info(addr):
-        try:
-            addr = ipaddress.ip_address(addr)
-        except Exception as e:
-            import sys
-            sys.stderr.write(str(e))
-            return Response(
-                    'Error\nInvalid input (not an IP address)\n',
-                    mimetype='text/plain'
-                    ), 400
-        return print_client_ip_info_handler(addr)
-
-except:
-    # Oh well.
-    pass
-
-try:
-    import telnum
-
-    @app.route('/telnum/<path:num>')
-    def phone_number_info(num, wikipedia=False):
-        result = telnum.number_to_text(num)
-        parts = result.split()
-        if wikipedia and parts[-1] != 'invalid':
-            country_code = parts[0]
-            return static_redirect_handler('https://en.wikipedia.org/wiki/' + quote(country_code))
-
-        else:
-            return Response(
-                    result + '\n',
-                    mimetype='text/plain'
-                    )
-
-    @app.route('/telnum/<path:num>/wiki')
-    def phone_number_plan_wikipedia(num):
-        return phone_number_info(num, True)
+@app.route('/telnum/<path:num>/wiki')
+def phone_number_plan_wikipedia(num):
+    return phone_number_info(num, True)
+
+@app.route('/telnum', methods=['POST'])
+def phone_number_info_batch():
+    # one output line per (non-empty) input line, streamed as we go:
+    # the number as given, then the lines of /telnum's output, separated by
+    # " | " (or JSON lines with ?json)
+    if telnum_module.get() is None:
+        abort(404)
+    json_mode = 'json' in request.args
+    nums = batch_lines(request.get_data(as_text=True))
+
+    def generate():
+        for num in nums:
+            result = telnum_text(telnum_key(num))
+            if json_mode:
+                yield {
+                    'query': num,
+                    'result': result.splitlines(),
+                    'valid': result.split()[-1] != 'invalid',
+                }
+            else:
+                yield ' | '.join([num] + result.splitlines())
 
+    return batch_response(generate(), json_mode)
 
-except:
-    # Oh well.
-    pass
-
-try:
+def load_ula():
     import ula
+    return ula
 
-    @app.route('/ula')
-    def ipv6_unique_local_address():
-        return Response(
-                str(ula.generate_ula()) + '\n',
-                mimetype='text/plain'
-                )
+ula_module = lazy.LazyResource(load_ula,
+        'Could not import ula module. ULA functionality will be disabled.',
+        probe=lazy.modules_exist('ula'))
+endpoint_resources['ipv6_unique_local_address'] = ula_module
 
-except:
-    # Oh well.
-    pass
+@app.route('/ula')
+def ipv6_unique_local_address():
+    ula = ula_module.get()
+    if ula is None:
+        abort(404)
+
+    return Response(
+            str(ula.generate_ula()) + '\n',
+            mimetype='text/plain'
+            )
 
 GITIGNORE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'github-gitignore')
 OUI_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'oui.txt')
-
-if os.path.isdir(GITIGNORE_PATH):
-    @app.route('/gitignore/<string:query>')
-    @app.route('/ignore/<string:query>')
-    def gitignore_template(query):
-        query_filename = '%s.gitignore' % query
-        for filename in glob.glob(os.path.join(GITIGNORE_PATH, '*.gitignore')) + glob.glob(os.path.join(GITIGNORE_PATH, 'Global', '*.gitignore')):
-            if filename.lower().endswith(query_filename.lower()):
-                return send_file(filename, mimetype='text/plain')
-        # If we get this far, nothing was found:
-        return Response(
-                '# No gitignore file found for "%s"\n' % query,
-                mimetype='text/plain'
-                ), 404
-
-if os.path.isfile(OUI_PATH):
-    @app.route('/mac/<string:query>')
-    @app.route('/oui/<string:query>')
-    def oui_lookup(query):
-        if not os.path.isfile(OUI_PATH):
+OUI_DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'oui.db')
+
+def load_gitignore_index():
+    if not os.path.isdir(GITIGNORE_PATH):
+        return None
+    index = gitignores.GitignoreIndex(GITIGNORE_PATH)
+    index.reload()
+    return index
+
+gitignore_index = lazy.LazyResource(load_gitignore_index,
+        'Could not load gitignore templates. Gitignore functionality will be disabled.',
+        probe=lambda: os.path.isdir(GITIGNORE_PATH))
+endpoint_resources['gitignore_template'] = gitignore_index
+
+@app.route('/gitignore/<string:query>')
+@app.route('/ignore/<string:query>')
+def gitignore_template(query):
+    index = gitignore_index.get()
+    if index is None:
+        abort(404)
+
+    # several templates can be combined, e.g. Python,Node,macOS
+    names = index.split_names(query)
+
+    if len(names) > 1:
+        with metrics.upstream_call('gitignore', 'merge'):
+            merged = index.get_merged(names)
+        if merged is None:
+            missing = [name for name in names if index.get(name) is None]
             return Response(
-                    'Error\nOUI file missing\n',
+                    ''.join('# No gitignore file found for "%s"\n' % name for name in missing),
                     mimetype='text/plain'
-                    ), 500
+                    ), 404
+        content, etag = merged
 
-        # transform OUI into format 3C-D9-2B
-        match = re.match('^([0-9A-Fa-f]{2})[:-]?([0-9A-Fa-f]{2})[:-]?([0-9A-Fa-f]{2})', query)
-        if not match:
+    else:
+        with metrics.upstream_call('gitignore', 'get'):
+            template = index.get(names[0]) if names else None
+        if template is None:
             return Response(
-                    'Error\nInvalid input (not an EUI)\n',
+                    '# No gitignore file found for "%s"\n' % query,
                     mimetype='text/plain'
-                    ), 400
+                    ), 404
+        name, content, etag = template
+
+    response = Response(content, mimetype='text/plain')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def load_oui_index():
+    if os.path.isfile(OUI_DB_PATH):
+        index = ouidb.OUIDatabase(OUI_DB_PATH)
+    elif os.path.isfile(OUI_PATH):
+        index = ouidb.OUIIndex(OUI_PATH)
+    else:
+        return None
+    index.reload()
+    return index
+
+oui_index = lazy.LazyResource(load_oui_index,
+        'Could not load OUI data. MAC address lookups will be redirected.')
+
+def describe_eui(query, cache=None):
+    # returns: (HTTP status, first output line, second output line)
+    # cache: optional dict to share lookups between several queries
+
+    # transform OUI into format 3C-D9-2B
+    match = re.match('^([0-9A-Fa-f]{2})[:-]?([0-9A-Fa-f]{2})[:-]?([0-9A-Fa-f]{2})([0-9A-Fa-f:-]*)', query)
+    if not match:
+        return (400, 'Error', 'Invalid input (not an EUI)')
+
+    oui = '%s-%s-%s' % match.groups()[:3]
+    oui = oui.upper()
+
+    octet1 = int(match.group(1), 16)
+    locally_administered = (octet1 & (1<<1))
+    multicast = (octet1 & 1)
+    multicast_str = ', multicast' if multicast else ''
+
+    if locally_administered:
+        return (200, oui, 'locally administered address%s' % multicast_str)
+
+    # any digits beyond the OUI allow matching MA-M/MA-S/IAB blocks
+    digits = (''.join(match.groups()[:3]) + re.sub('[:-]', '', match.group(4)))[:12]
+    address = bytes.fromhex(digits.ljust(12, '0'))
+
+    # the result only depends on the bits covered by the longest block
+    known_bits = min(len(digits) * 4, ouidb.PREFIX_LENGTHS[0])
+    key = (ouidb.mask_prefix(address, known_bits), known_bits)
+    if cache is not None and key in cache:
+        result = cache[key]
+    else:
+        index = oui_index.get()
+        with metrics.upstream_call('oui', 'lookup'):
+            result = index.lookup(*key) if index is not None else None
+        if cache is not None:
+            cache[key] = result
+
+    if result is None:
+        return (500, 'Error', 'OUI file missing')
+
+    bits, organization = result
+    if organization:
+        return (200, ouidb.format_prefix(ouidb.mask_prefix(address, bits), bits), organization + multicast_str)
+
+    return (404, oui, 'No organisation found%s' % multicast_str)
+
+def oui_batch_response(queries):
+    # one output line per (non-empty) input line, streamed as we go
+    json_mode = 'json' in request.args
+
+    def generate():
+        cache = dict()
+        for query in queries:
+            status, first, second = describe_eui(query, cache)
+            if json_mode:
+                yield {
+                    'query': query,
+                    'status': status,
+                    'prefix': first,
+                    'description': second,
+                }
+            else:
+                yield '%s | %s | %s' % (query, first, second)
 
-        oui = '%s-%s-%s' % match.groups()
-        oui = oui.upper()
+    return batch_response(generate(), json_mode)
 
-        octet1 = int(match.group(1), 16)
-        locally_administered = (octet1 & (1<<1))
-        multicast = (octet1 & 1)
-        multicast_str = ', multicast' if multicast else ''
+@app.route('/mac/<path:query>')
+@app.route('/oui/<path:query>')
+def oui_lookup(query):
+    if oui_index.get() is None:
+        # no local data
+        return simple_query_handler('http://coffer.com/mac_find/?string=%s', query)
 
-        if locally_administered:
-            return Response(
-                    '%s\nlocally administered address%s\n' % (oui, multicast_str),
-                    mimetype='text/plain'
-                    ), 200
-
-        with open(OUI_PATH, 'r') as f:
-            for line in f:
-                if line.startswith(oui):
-                    parts = line.split(maxsplit=2)
-                    if len(parts) != 3:
-                        return Response(
-                                'Error\nFormat error in OUI file\n',
-                                mimetype='text/plain'
-                                ), 500
-                    organization = parts[-1]
-                    return Response(
-                            '%s\n%s%s\n' % (oui, organization, multicast_str),
-                            mimetype='text/plain'
-                            ), 200
+    if ',' in query:
+        return oui_batch_response(batch_lines(query.replace(',', '\n')))
 
-        return Response(
-                '%s\nNo organisation found%s\n' % (oui, multicast_str),
-                mimetype='text/plain'
-                ), 404
-
-else:
-    @app.route('/mac/<path:query>')
-    @app.route('/oui/<path:query>')
-    def mac_address_vendor_lookup(query):
-        return simple_query_handler('http://coffer.com/mac_find/?string=%s', query)
+    status, first, second = describe_eui(query)
+    return Response(
+            '%s\n%s\n' % (first, second),
+            mimetype='text/plain'
+            ), status
 
+@app.route('/mac', methods=['POST'])
+@app.route('/oui', methods=['POST'])
+def oui_batch_lookup():
+    if oui_index.get() is None:
+        abort(404)
+    return oui_batch_response(batch_lines(request.get_data(as_text=True)))
 
 @app.route('/clean/<path:query>')
 @app.route('/cleango/<path:query>')
@@ -543,31 +678,15 @@ def url_clean(query):
     if request.query_string:
         query += '?' + request.query_string.decode('utf-8')
 
-    print(query)
-
-    url = None
-
-    # Google URL format:
-    # https://www.google.com/url?sa=t&source=web&rct=j&url=https://www.example.com/page%3Fparam%3Dvalue&ved=2ahUKEwiY3OaWh-XpAhXytYsKHZSOBaAQwqsBMAF6BAgHEAg&usg=AOvVaw2r6f5XJRxROXt-aRr_r3lI
-    match = re.match(r'^https?://www\.google\.com/url?.*url=([^&]+)', query)
-    if match:
-        url = unquote(match.group(1))
+    if len(query) > urlclean.MAX_URL_LENGTH:
+        return Response(
+                'Error\nInvalid input (URL too long)\n',
+                mimetype='text/plain'
+                ), 400
 
-    # AMP URL format:
-    # https://www.google.com/amp/s/www.theregister.co.uk/AMP/2015/09/15/still_200k_iot_heartbleed_vulns/
-    # -> https://www.theregister.co.uk/2015/09/15/still_200k_iot_heartbleed_vulns/
-    # https://www.google.com/amp/s/www.golem.de/news/fuzzing-wie-man-heartbleed-haette-finden-koennen-1504-113345.amp.html
-    # -> https://www.golem.de/news/fuzzing-wie-man-heartbleed-haette-finden-koennen-1504-113345.html
-    match = re.match(r'^(https?://)www\.google\.com/amp/s/(.+)', query)
-    if match:
-        url = match.group(1) + match.group(2)
-        url = re.sub(r'([^a-zA-Z0-9])[Aa][Mm][Pp]\1', r'\1', url)
+    eventlog.log('url_clean', query=query)
 
-    # Amazon URL format:
-    # https://www.amazon.de/DSLRKIT-Ethernet-Splitter-Development-Raspberry/dp/B074Y6M67F/ref=foo_bar_1234_0?_encoding=UTF8&etcpp
-    match = re.match(r'^(https://)(www\.|smile\.)?amazon\.([a-z]{2,3})/.*dp/([A-Z0-9]{10}/)', query)
-    if match:
-        url = match.group(1) + 'www.amazon.' + match.group(3) + '/dp/' + match.group(4)
+    url = urlclean.clean_url(query)
 
     if not url:
         return Response(
@@ -583,6 +702,39 @@ def url_clean(query):
                 mimetype='text/plain'
                 ), 200
 
+@app.route('/clean', methods=['POST'])
+def url_clean_batch():
+    # one output line per (non-empty) input line, streamed as we go;
+    # unrecognised URLs are passed through unchanged, or flagged as errors
+    # with ?strict
+    json_mode = 'json' in request.args
+    strict = 'strict' in request.args
+    queries = batch_lines(request.get_data(as_text=True))
+
+    def generate():
+        for query in queries:
+            if len(query) > urlclean.MAX_URL_LENGTH:
+                url, error = None, 'Invalid input (URL too long)'
+            else:
+                url = urlclean.clean_url(query)
+                error = None if url else 'Invalid input (URL format not recognised)'
+
+            if json_mode:
+                yield {
+                    'query': query,
+                    'url': url or query,
+                    'cleaned': url is not None,
+                    'error': error,
+                }
+            elif url:
+                yield url
+            elif strict:
+                yield 'Error | %s | %s' % (query, error)
+            else:
+                yield query
+
+    return batch_response(generate(), json_mode)
+
 @app.route('/urldecode/<path:query>')
 @app.route('/ud/<path:query>')
 def urldecode(query):
@@ -620,173 +772,24 @@ def baureihe_nvr_de(query):
 
     return static_redirect_handler(br_url + search_fragment)
 
-@app.route('/ula.ext')
-def ipv6_unique_local_address_external():
-    return static_redirect_handler('http://simpledns.com/private-ipv6.aspx')
-
-@app.route('/google/<path:query>')
-@app.route('/g/<path:query>')
-def google(query):
-    return simple_query_handler('https://www.google.com/search?q=%s', query)
-
-@app.route('/i/<path:query>')
-@app.route('/gi/<path:query>')
-def google_image(query):
-    return simple_query_handler('https://www.google.com/search?q=%s&tbm=isch', query)
-
-@app.route('/v/<path:query>')
-@app.route('/gv/<path:query>')
-def google_video(query):
-    return simple_query_handler('https://www.google.com/search?q=%s&tbm=vid', query)
-
-@app.route('/inwx/<path:query>')
-def domain_check_inwx(query):
-    return simple_query_handler('https://www.inwx.de/de/domain/check#search=%s#region=DEFAULT#rc=rc1', query)
-
-@app.route('/ovh/<path:query>')
-def domain_check_ovh(query):
-    return simple_query_handler('https://www.ovh.de/cgi-bin/newOrder/order.cgi?domain_domainChooser_domain=%s', query)
-
-@app.route('/tineye/<path:query>')
-def tineye(query):
-    return simple_query_handler('https://tineye.com/search?url=%s', query)
-
-@app.route('/madison/<path:query>')
-def madison(query):
-    return simple_query_handler('https://qa.debian.org/madison.php?table=all&g=on&package=%s', query)
-
-@app.route('/deb/<path:query>')
-def madison_debian(query):
-    return simple_query_handler('https://qa.debian.org/madison.php?table=debian&g=on&package=%s', query)
-
-@app.route('/ubu/<path:query>')
-def madison_ubuntu(query):
-    return simple_query_handler('https://qa.debian.org/madison.php?table=ubuntu&g=on&package=%s', query)
-
-@app.route('/dpkg/<path:query>')
-def packages_debian(query):
-    return simple_query_handler('https://packages.debian.org/search?keywords=%s', query)
-
-@app.route('/upkg/<path:query>')
-def packages_ubuntu(query):
-    return simple_query_handler('http://packages.ubuntu.com/search?keywords=%s', query)
-
-@app.route('/apkg/<path:query>')
-def packages_archlinux(query):
-    return simple_query_handler('https://www.archlinux.org/packages/?q=%s', query)
-
-@app.route('/aur/<path:query>')
-def packages_archuserrepo(query):
-    return simple_query_handler('https://aur.archlinux.org/packages/?K=%s', query)
-
-@app.route('/repo')
-def packages_repology_stats():
-    return static_redirect_handler('https://repology.org/repositories/statistics')
-
-@app.route('/repo/<path:query>')
-def packages_repology_search(query):
-    return simple_query_handler('https://repology.org/projects/?search=%s', query)
-
-@app.route('/fport/<path:query>')
-@app.route('/fports/<path:query>')
-@app.route('/freshports/<path:query>')
-def packages_freebsd_freshports(query):
-    return simple_query_handler('https://www.freshports.org/search.php?num=20&query=%s', query)
-
-@app.route('/gpkg/<path:query>')
-@app.route('/eix/<path:query>')
-def packages_gentoo(query):
-    return simple_query_handler('https://packages.gentoo.org/packages/search?q=%s', query)
-
-@app.route('/mensa')
-def mensa_uni_passau():
-    return static_redirect_handler('http://www.stwno.de/infomax/daten-extern/html/speiseplaene.php?einrichtung=UNI-P')
-
-@app.route('/strings.bash')
-@app.route('/bash-strings')
-def string_manipulation_bash():
-    return static_redirect_handler('http://tldp.org/LDP/abs/html/string-manipulation.html')
-
-@app.route('/strings.sh')
-def string_manipulation_posix():
-    return static_redirect_handler('https://pubs.opengroup.org/onlinepubs/9699919799.2008edition/utilities/V3_chap02.html#tag_18_06_02')
-
-@app.route('/denic/<path:query>')
-def denic_web_whois(query):
-    return simple_query_handler('https://www.denic.de/webwhois-web20/?domain=%s', query)
-
-@app.route('/ssll/<path:query>')
-def ssllabs(query):
-    return simple_query_handler('https://www.ssllabs.com/ssltest/analyze.html?d=%s&hideResults=on&latest', query)
-
-@app.route('/bgp/<path:query>')
-def hurricane_electric_bgp(query):
-    return simple_query_handler('http://bgp.he.net/search?commit=Search&search[search]=%s', query)
-
-@app.route('/tld/<path:query>')
-def tldlist_tld_info(query):
-    return simple_query_handler('https://tld-list.com/tld/%s', query)
-
-@app.route('/woa/<path:query>')
-def wolfram_alpha(query):
-    return simple_query_handler('https://www.wolframalpha.com/input/?i=%s', query)
-
-@app.route('/dcc/<path:query>')
-def dict_cc(query):
-    return simple_query_handler('https://www.dict.cc/?s=%s', query)
-
-@app.route('/gif/<path:query>')
-def giphy(query):
-    return simple_query_handler('http://giphy.com/search/%s', query)
-
-@app.route('/fp')
-def facepalm():
-    return static_redirect_handler('http://i3.kym-cdn.com/photos/images/original/000/001/582/picard-facepalm.jpg')
-
-@app.route('/randname')
-def randname():
-    return static_redirect_handler('http://www.behindthename.com/random/random.php?number=1&gender=u&surname=&nodiminutives=yes&all=yes')
-
-@app.route('/ukcomp/<path:query>')
-def uk_company_registrations(query):
-    return simple_query_handler('https://beta.companieshouse.gov.uk/search?q=%s', query)
-
-@app.route('/uci/<path:query>')
-@app.route('/unicode/<path:query>')
-def unicode_character_inspector(query):
-    return simple_query_handler('https://apps.timwhitlock.info/unicode/inspect?s=%s', query)
-
-@app.route('/ucs/<path:query>')
-@app.route('/sunicode/<path:query>')
-def unicode_character_search(query):
-    return simple_query_handler('http://www.fileformat.info/info/unicode/char/search.htm?q=%s&preview=entity', query)
-
-@app.route('/wiki/<path:query>')
-@app.route('/enwiki/<path:query>')
-def wikipedia_en(query):
-    return simple_query_handler('https://en.wikipedia.org/w/index.php?search=%s', query)
-
-@app.route('/dewiki/<path:query>')
-def wikipedia_de(query):
-    return simple_query_handler('https://de.wikipedia.org/w/index.php?search=%s', query)
+@app.route('/<string:keyword>')
+@app.route('/<string:keyword>/<path:query>')
+def provider_redirect(keyword, query=None):
+    # all plain search and redirect keywords, see providers.py
+    entry = provider_registry.lookup(keyword)
+    if entry is not None:
+        if query is None and 'static' in entry:
+            name, url, mode = entry['static']
+            return static_redirect_handler(url, mode)
+        elif query is not None and 'query' in entry:
+            name, url, mode = entry['query']
+            return simple_query_handler(url, query, mode)
+    abort(404)
 
 @app.route('/rfc/<int:query>')
 def rfc_by_number(query):
     return simple_query_handler('https://tools.ietf.org/html/rfc%s', str(query))
 
-@app.route('/rfc/<path:query>')
-def rfc_text_search(query):
-    return simple_query_handler('https://tools.ietf.org/googleresults?q=%s', query)
-
-@app.route('/ark/<path:query>')
-def intel_ark(query):
-    return simple_query_handler('https://ark.intel.com/content/www/us/en/ark/search.html?q=%s', query)
-
-@app.route('/posix')
-@app.route('/posix2008')
-def posix_2008():
-    return static_redirect_handler('https://pubs.opengroup.org/onlinepubs/9699919799.2008edition/')
-
 @app.route('/posix/<path:query>')
 @app.route('/posix2008/<path:query>')
 def posix_2008_lookup(query):
@@ -795,10 +798,6 @@ def posix_2008_lookup(query):
     else:
         return static_redirect_handler('https://pubs.opengroup.org/onlinepubs/9699919799.2008edition/utilities/%s.html' % (query))
 
-@app.route('/ansible/<path:query>')
-def ansible_module(query):
-    return simple_query_handler('https://docs.ansible.com/ansible/latest/modules/%s_module.html', query)
-
 @app.route('/dhl/<string:piececode>')
 @app.route('/dhl/<string:piececode>/<string:zipcode>')
 def dhl_tracking(piececode, zipcode=''):
@@ -806,9 +805,16 @@ def dhl_tracking(piececode, zipcode=''):
     language = request.accept_languages.best_match(supported_languages)
 
     if zipcode:
-        return redirect('https://nolp.dhl.de/nextt-online-public/%s/search?piececode=%s&zip=%s' % (language, quote_plus(piececode), quote_plus(zipcode)), code=303)
+        response = redirect('https://nolp.dhl.de/nextt-online-public/%s/search?piececode=%s&zip=%s' % (language, quote_plus(piececode), quote_plus(zipcode)), code=303)
     else:
-        return redirect('https://nolp.dhl.de/nextt-online-public/%s/search?piececode=%s' % (language, quote_plus(piececode)), code=303)
+        response = redirect('https://nolp.dhl.de/nextt-online-public/%s/search?piececode=%s' % (language, quote_plus(piececode)), code=303)
+    # the target depends on the browser's language, so caches must tell apart
+    response.vary.add('Accept-Language')
+    return response
+
+# optional warm-up, see quicksearch.example.conf
+if os.environ.get('QUICKSEARCH_PRELOAD', '0') != '0':
+    lazy.preload()
 
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# encoding: utf-8 (as per PEP 263)
+
+# ASGI entry point for quicksearch, e.g.
+#
+#   uvicorn --host ::1 --port 8050 quicksearch_asgi:app
+#
+# The /zug and /ipi endpoints are answered right here with async I/O (httpx
+# for bahn.expert, dnspython's asyncio resolver for DNS), so waiting for a
+# slow upstream server doesn't tie up a thread.  All other requests are
+# handed to the regular WSGI app (quicksearch.app, which can still be served
+# by twistd etc. on its own) in a thread pool.  If httpx or a recent enough
+# dnspython isn't available, the affected endpoints are handed over too.
+
+import asyncio
+import concurrent.futures
+import contextvars
+import io
+import ipaddress
+import os
+import sys
+import time
+
+from flask import Response
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.wrappers import Request
+
+import bahnexpert
+import eventlog
+import lazy
+import metrics
+import quicksearch
+
+# threads for the requests handed to the WSGI app
+wsgi_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=int(os.environ.get('QUICKSEARCH_ASGI_THREADS', 16)))
+
+# applies the same X-Forwarded-For handling as the WSGI app's ProxyFix to an
+# environ (and returns it), for the requests answered here
+proxy_fix = ProxyFix(lambda environ, start_response: environ)
+
+# endpoint name -> (lazy.LazyResource the handler needs,
+#                   coroutine function(request, **URL rule arguments))
+async_handlers = dict()
+
+
+def load_async_bahnexpert_client():
+    client = quicksearch.bahnexpert_client.get()
+    if client is None:
+        return None
+    # same settings and cache as the WSGI app's client
+    return bahnexpert.AsyncBahnExpertClient(*client.timeout, cache=client.cache)
+
+
+def load_async_ipinfo_resolver():
+    import ipinfo
+
+    if ipinfo.asyncresolver is None:
+        return None
+    # same settings and cache as the WSGI app
+    return quicksearch.ipinfo_resolver.get()
+
+
+bahnexpert_client = lazy.LazyResource(load_async_bahnexpert_client,
+        'Could not import httpx module. Train searches will be passed on to the WSGI app.')
+
+
+async def train_search(request, zugnr, searchdate=None, country='DE'):
+    # see quicksearch.bahn_expert_train_number
+    try:
+        searchdates = bahnexpert.expand_searchdates(searchdate, request.args.get('days'))
+    except ValueError:
+        return quicksearch.invalid_days_response()
+    countries = [c for c in country.split(',') if c]
+
+    try:
+        results = await bahnexpert_client.get().find_trains(zugnr, searchdates, countries)
+    except Exception as e:
+        return quicksearch.train_search_error_response(e)
+
+    return quicksearch.train_search_response(results, 'v' in request.args)
+
+
+async_handlers['bahn_expert_train_number'] = (bahnexpert_client, train_search)
+async_handlers['bahn_expert_train_date_number'] = (bahnexpert_client, train_search)
+async_handlers['bahn_expert_train_country_date_number'] = (bahnexpert_client, train_search)
+
+
+ipinfo_resolver = lazy.LazyResource(load_async_ipinfo_resolver,
+        'Could not import dnspython module. IP info lookups will be passed on to the WSGI app.')
+
+
+async def ip_info_batch(request):
+    addrs = quicksearch.batch_lines(request.get_data(as_text=True))
+
+    async def generate():
+        async for lines in ipinfo_resolver.get().describe_many_async(addrs, quicksearch.ipinfo_batch_window):
+            yield quicksearch.ip_info_line(lines) + '\n'
+
+    return Response(
+            generate(),
+            mimetype='text/plain'
+            )
+
+
+async def whats_my_ip_info(request):
+    addr = ipaddress.ip_address(request.remote_addr)
+    return quicksearch.ip_info_response(await ipinfo_resolver.get().describe_async(addr))
+
+
+async def ip_info(request, addr):
+    try:
+        addr = ipaddress.ip_address(addr)
+    except Exception as e:
+        return quicksearch.invalid_address_response(e)
+    return quicksearch.ip_info_response(await ipinfo_resolver.get().describe_async(addr))
+
+
+async_handlers['ip_info_batch'] = (ipinfo_resolver, ip_info_batch)
+async_handlers['whats_my_ip_info'] = (ipinfo_resolver, whats_my_ip_info)
+async_handlers['ip_info'] = (ipinfo_resolver, ip_info)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            # client went away
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def wsgi_environ(scope, body):
+    # returns: a WSGI environ (PEP 3333) for an ASGI HTTP request
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key in environ:
+            value = environ[key] + ',' + value
+        environ[key] = value
+
+    return environ
+
+
+async def find_async_handler(environ):
+    # returns: (endpoint name, coroutine function, URL rule arguments) if
+    #          the request is answered here, else (None, None, None)
+    try:
+        endpoint, values = quicksearch.app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        # 404, 405 or a redirect: Flask's business
+        return (None, None, None)
+    entry = async_handlers.get(endpoint)
+    if entry is None:
+        return (None, None, None)
+
+    # (each request runs in its own task, i.e. its own context)
+    eventlog.endpoint.set(endpoint)
+
+    resource, handler = entry
+    if resource.get_if_loaded() is None:
+        # (first use) imports and data files are loaded outside the event
+        # loop; if that fails, the WSGI app will know what to do
+        load = contextvars.copy_context().run
+        if await asyncio.get_running_loop().run_in_executor(wsgi_executor, load, resource.get) is None:
+            return (None, None, None)
+    return (endpoint, handler, values)
+
+
+def run_wsgi(environ, send, loop):
+    # runs in a worker thread; each ASGI message is sent (and waited for)
+    # from the event loop, so a slow client slows down the iteration
+    status_headers = []
+
+    def start_response(status, headers, exc_info=None):
+        status_headers[:] = [status, headers]
+
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def send_start():
+        status, headers = status_headers
+        send_message({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+
+    iterable = quicksearch.app(environ, start_response)
+    try:
+        started = False
+        for chunk in iterable:
+            if not chunk:
+                continue
+            if not started:
+                send_start()
+                started = True
+            send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not started:
+            send_start()
+        send_message({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+async def send_response(send, request, response):
+    # response: a Response, or (Response, status code) as returned by Flask
+    #           views; the body may be an async iterator of str/bytes
+    if type(response) == tuple:
+        response, status = response
+        response.status_code = status
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.get_wsgi_headers(request.environ).to_wsgi_list()],
+    })
+
+    if request.method != 'HEAD' and hasattr(response.response, '__aiter__'):
+        async for chunk in response.response:
+            if type(chunk) == str:
+                chunk = chunk.encode('utf-8')
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    elif request.method != 'HEAD':
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+    else:
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if os.environ.get('QUICKSEARCH_PRELOAD', '0') != '0':
+                # also covers the resources defined here
+                await asyncio.get_running_loop().run_in_executor(wsgi_executor, lazy.preload)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            client = bahnexpert_client.get_if_loaded()
+            if client is not None:
+                await client.aclose()
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        # no websockets here
+        return
+
+    environ = wsgi_environ(scope, await read_body(receive))
+
+    endpoint, handler, values = await find_async_handler(environ)
+    if handler is None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(wsgi_executor, run_wsgi, environ, send, loop)
+        return
+
+    # the WSGI app records its own requests (see metrics.MetricsMiddleware)
+    start = time.perf_counter()
+    request = Request(proxy_fix(environ, None))
+    response = await handler(request, **values)
+    status = response[1] if type(response) == tuple else response.status_code
+    metrics.record_request(endpoint, str(status), time.perf_counter() - start)
+
+    await send_response(send, request, response)
@@ -0,0 +1,64 @@
+# encoding: utf-8 (as per PEP 263)
+
+# Data loaded from files that are reloaded transparently whenever they change
+# (the provider table, the gitignore templates, the OUI and ASN databases), so
+# refreshing them doesn't require a restart.
+
+import threading
+
+# signature of data that hasn't been loaded yet (unlike None, which is a valid
+# signature, e.g. for a file that doesn't exist)
+NOT_LOADED = object()
+
+
+class Reloader:
+    # Keeps the data in a single (signature, data) tuple that is replaced as a
+    # whole, never mutated, so readers only ever see either the old or the new
+    # complete data.
+    #
+    # signature: function returning something that changes whenever the files
+    #            do (e.g. their mtimes); called on every get()
+    # load: function(previous data or None) returning the new data; it may
+    #       fall back to the previous data if the files turn out to be broken
+    # background: load in a background thread (for data that takes a while to
+    #             load), so that get() never waits and returns None until the
+    #             first load is done
+
+    def __init__(self, signature, load, background=False, name='reloader'):
+        self.signature = signature
+        self.load = load
+        self.background = background
+        self.name = name
+        self._state = (NOT_LOADED, None)
+        self._lock = threading.Lock()
+
+    def get(self):
+        # returns: the current data (reloaded first if the signature changed)
+        signature = self.signature()
+        state = self._state
+        if state[0] == signature:
+            return state[1]
+
+        if self.background:
+            if self._lock.acquire(blocking=False):
+                threading.Thread(target=self._reload, args=(signature,), name=self.name, daemon=True).start()
+            return state[1]
+
+        # Only the first load makes requests wait; later reloads are done by
+        # whichever request notices the change first while everybody else
+        # keeps using the previous data.
+        if not self._lock.acquire(blocking=state[0] is NOT_LOADED):
+            return state[1]
+        try:
+            if self._state[0] != signature:
+                self._state = (signature, self.load(self._state[1]))
+        finally:
+            self._lock.release()
+
+        return self._state[1]
+
+    def _reload(self, signature):
+        try:
+            self._state = (signature, self.load(self._state[1]))
+        finally:
+            self._lock.release()
@@ -0,0 +1,135 @@
+# encoding: utf-8 (as per PEP 263)
+
+# Small thread-safe in-memory cache for results of slow upstream queries.
+#
+# - Entries expire after `ttl` seconds (or after ttl_func(value) seconds, if
+#   given, for per-entry lifetimes) and the least recently used ones are
+#   evicted once more than `maxsize` are stored.
+# - For another `stale_ttl` seconds after expiry an entry is still returned
+#   immediately while a background thread fetches a fresh value
+#   (stale-while-revalidate).
+# - Concurrent misses for the same key are collapsed into a single call of
+#   the compute function (single-flight); the other callers wait for and
+#   share its result (or exception).
+# - get_async() is the same for coroutine compute functions, for use from an
+#   asyncio event loop (see quicksearch_asgi.py); both can share one cache.
+
+import asyncio
+import collections
+import threading
+import time
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60, stale_ttl=0, ttl_func=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttl_func = ttl_func
+        self.stale_ttl = stale_ttl
+        # key -> (expiry time, end of stale period, value)
+        self._entries = collections.OrderedDict()
+        # key -> _Flight for every compute call currently running
+        self._flights = dict()
+        # key -> asyncio.Task for every async compute call currently running
+        self._async_flights = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        # returns: the cached value for `key`, calling compute() if necessary
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, stale_until, value = entry
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    return value
+                if now < stale_until:
+                    if key not in self._flights:
+                        flight = self._flights[key] = _Flight()
+                        threading.Thread(target=self._compute, args=(key, compute, flight), daemon=True).start()
+                    return value
+                del self._entries[key]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            self._compute(key, compute, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    async def get_async(self, key, compute):
+        # returns: the cached value for `key`, awaiting compute() if necessary
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, stale_until, value = entry
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    return value
+                if now < stale_until:
+                    if key not in self._async_flights:
+                        self._start_async_flight(key, compute)
+                    return value
+                del self._entries[key]
+
+            task = self._async_flights.get(key)
+            if task is None:
+                task = self._start_async_flight(key, compute)
+
+        # a caller that is cancelled (e.g. because its client went away)
+        # doesn't cancel the computation for everybody else
+        return await asyncio.shield(task)
+
+    def _start_async_flight(self, key, compute):
+        task = self._async_flights[key] = asyncio.ensure_future(self._compute_async(key, compute))
+        # errors are passed on to whoever awaits the task, but a background
+        # refresh may have nobody waiting for it
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return task
+
+    async def _compute_async(self, key, compute):
+        try:
+            value = await compute()
+            self._store(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._async_flights.pop(key, None)
+
+    def _store(self, key, value):
+        ttl = self.ttl if self.ttl_func is None else self.ttl_func(value)
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + ttl, now + ttl + self.stale_ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _compute(self, key, compute, flight):
+        try:
+            flight.value = compute()
+        except Exception as e:
+            # errors are shared with the waiting callers, but not cached
+            flight.error = e
+        else:
+            self._store(key, flight.value)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
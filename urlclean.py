@@ -0,0 +1,141 @@
+# encoding: utf-8 (as per PEP 263)
+
+# URL cleaning rules for quicksearch's /clean/ and /go/ endpoints.
+#
+# Every rule applies to a set of hosts and is only tried for URLs on one of
+# them; a host entry ending in ".*" matches any (one- or two-label) top-level
+# domain, e.g. "www.amazon.*" covers www.amazon.de and www.amazon.co.uk.
+# After that, well-known tracking parameters (utm_*, fbclid, gclid, ...) are
+# stripped from the query string of whatever URL we ended up with.
+#
+# benchmarks/bench_urlclean.py times every rule and checks each pattern for
+# catastrophic backtracking (ReDoS); run it after adding or changing rules.
+
+import re
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit, urlunsplit
+
+# longer inputs are rejected before any rule runs
+MAX_URL_LENGTH = 8192
+
+TRACKING_PARAMETER_PREFIXES = ('utm_',)
+TRACKING_PARAMETERS = {
+    'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'msclkid', 'yclid',
+    'igshid', 'mc_cid', 'mc_eid', '_hsenc', '_hsmi',
+}
+
+
+def google_redirect(match):
+    # https://www.google.com/url?sa=t&source=web&rct=j&url=https://www.example.com/page%3Fparam%3Dvalue&ved=2ahUKEwiY3OaWh-XpAhXytYsKHZSOBaAQwqsBMAF6BAgHEAg&usg=AOvVaw2r6f5XJRxROXt-aRr_r3lI
+    # -> https://www.example.com/page?param=value
+    return unquote(match.group(1))
+
+
+def google_amp(match):
+    # https://www.google.com/amp/s/www.theregister.co.uk/AMP/2015/09/15/still_200k_iot_heartbleed_vulns/
+    # -> https://www.theregister.co.uk/2015/09/15/still_200k_iot_heartbleed_vulns/
+    # https://www.google.com/amp/s/www.golem.de/news/fuzzing-wie-man-heartbleed-haette-finden-koennen-1504-113345.amp.html
+    # -> https://www.golem.de/news/fuzzing-wie-man-heartbleed-haette-finden-koennen-1504-113345.html
+    url = match.group(1) + match.group(2)
+    return AMP_MARKER.sub(r'\1', url)
+
+
+def amazon_product(match):
+    # https://www.amazon.de/DSLRKIT-Ethernet-Splitter-Development-Raspberry/dp/B074Y6M67F/ref=foo_bar_1234_0?_encoding=UTF8&etcpp
+    # -> https://www.amazon.de/dp/B074Y6M67F/
+    return match.group(1) + 'www.amazon.' + match.group(3) + '/dp/' + match.group(4)
+
+
+AMP_MARKER = re.compile(r'([^a-zA-Z0-9])[Aa][Mm][Pp]\1')
+
+# (name, hosts, pattern, transform function taking the match object)
+RULES = [
+    (
+        'google_redirect',
+        ['www.google.com'],
+        r'^https?://www\.google\.com/url?.*url=([^&]+)',
+        google_redirect,
+    ),
+    (
+        'google_amp',
+        ['www.google.com'],
+        r'^(https?://)www\.google\.com/amp/s/(.+)',
+        google_amp,
+    ),
+    (
+        'amazon_product',
+        ['amazon.*', 'www.amazon.*', 'smile.amazon.*'],
+        r'^(https://)(www\.|smile\.)?amazon\.([a-z]{2,3})/.*dp/([A-Z0-9]{10}/)',
+        amazon_product,
+    ),
+]
+
+
+def compile_rules(rules):
+    # returns: dict mapping host (or wildcard host) to the list of
+    #          (name, compiled pattern, transform) to try for it
+    index = dict()
+    for name, hosts, pattern, transform in rules:
+        compiled = re.compile(pattern)
+        for host in hosts:
+            index.setdefault(host, []).append((name, compiled, transform))
+    return index
+
+
+RULES_BY_HOST = compile_rules(RULES)
+
+
+def rules_for_host(host):
+    rules = RULES_BY_HOST.get(host)
+    if rules is not None:
+        return rules
+
+    labels = host.split('.')
+    for tld_labels in (1, 2):
+        if len(labels) > tld_labels:
+            rules = RULES_BY_HOST.get('.'.join(labels[:-tld_labels]) + '.*')
+            if rules is not None:
+                return rules
+
+    return []
+
+
+def strip_tracking_parameters(url):
+    # returns: url without any tracking parameters (unchanged, i.e. not
+    #          re-encoded, if there weren't any)
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+
+    parameters = parse_qsl(parts.query, keep_blank_values=True)
+    kept = [
+            (key, value) for key, value in parameters
+            if key.lower() not in TRACKING_PARAMETERS
+            and not key.lower().startswith(TRACKING_PARAMETER_PREFIXES)
+            ]
+    if len(kept) == len(parameters):
+        return url
+
+    return urlunsplit(parts._replace(query=urlencode(kept)))
+
+
+def clean_url(url):
+    # returns: the cleaned URL, or None if no rule applied and there was
+    #          nothing to strip
+    try:
+        host = (urlsplit(url).hostname or '').lower()
+
+        cleaned = None
+        for name, pattern, transform in rules_for_host(host):
+            match = pattern.match(url)
+            if match:
+                cleaned = transform(match)
+                break
+
+        stripped = strip_tracking_parameters(cleaned or url)
+    except ValueError:
+        # not parseable as a URL
+        return None
+
+    if cleaned is None and stripped == url:
+        return None
+    return stripped